@@ -1,11 +1,15 @@
 import streamlit as st
-import pandas as pd
 import math
+import os
 from datetime import datetime, time
 
-from src.helpers import fetch_event_type_options, fetch_distinct_values, fetch_df, render_kiper_table
+from src.helpers import fetch_event_type_options, fetch_distinct_values, fetch_df, fetch_frame, render_kiper_table
+from src.helpers import render_kiper_table_virtual
 from src.helpers import init_state, apply_shared_period_to_widgets, sync_shared_period_from_widgets, PERIOD_KEYS
 from src.helpers import ensure_apply_state, apply_filters_now, mark_dirty, sync_period_and_mark_dirty
+from src.export import export_query, remove_export, read_export, EXPORT_FORMATS, EXPORT_LARGE_BYTES
+from src.totals import exact_total, fast_total, total_ready, total_failed
+from src.prefetch import get_page_prefetcher
 from ui.sidebar import render_sidebar_menu
 
 st.set_page_config(page_title="Relatórios • Hype", layout="wide")
@@ -17,6 +21,10 @@ apply_shared_period_to_widgets()
 st.session_state["current_page"] = "Relatórios"
 render_sidebar_menu()
 
+# Tabela virtualizada: cada ida ao banco traz um bloco de páginas, que o
+# navegador pagina sozinho (sem rerun)
+VIRTUAL_BLOCK_PAGES = 5
+
 def get_events_source() -> str:
     # "real" -> tabela real
     # qualquer outro modo -> view anon
@@ -133,6 +141,17 @@ with st.container(border=True):
                 st.rerun()
 
         with b3:
+            st.toggle(
+                "Total estimado (mais rápido)",
+                key="rel_fast_total",
+                help="Mostra na hora a estimativa do banco e calcula o total exato em segundo plano.",
+            )
+            st.toggle(
+                "Tabela virtualizada",
+                key="rel_virtual_table",
+                help=f"Carrega {VIRTUAL_BLOCK_PAGES} páginas por vez e troca de página no navegador, "
+                     "desenhando só as linhas visíveis.",
+            )
             st.caption("Dica: use os filtros avançados para refinar (ex.: só Moradores, só Prestadores, etc.).")
 
 
@@ -165,6 +184,11 @@ end_dt = datetime.combine(end_date, end_time)
 label_to_code = {o["label"]: o["code"] for o in event_options}
 event_types = [label_to_code[lbl] for lbl in selected_event_labels] if selected_event_labels else []
 
+# Linhas por ida ao banco: 1 página, ou um bloco de páginas na tabela virtualizada.
+# Com a tabela virtualizada, st.session_state.page conta blocos.
+virtual_table = bool(st.session_state.get("rel_virtual_table"))
+page_rows = int(limit) * (VIRTUAL_BLOCK_PAGES if virtual_table else 1)
+
 # Se mudou filtro, reseta página
 filter_key = (
     start_dt, end_dt,
@@ -172,12 +196,20 @@ filter_key = (
     tuple(accesses),
     tuple(profiles),
     search,
-    int(limit),
+    page_rows,
 )
 if st.session_state.last_filter_key != filter_key:
     st.session_state.page = 1
     st.session_state.last_filter_key = filter_key
 
+# Botões abaixo da tabela (paginação, exportação) reexecutam o script sem o
+# "Gerar relatório": mantém o relatório enquanto os filtros forem os mesmos
+# (linhas por página / modo da tabela não contam como filtro)
+if run:
+    st.session_state.rel_report_key = filter_key[:-1]
+elif st.session_state.get("rel_report_key") == filter_key[:-1]:
+    run = True
+
 # Só executa query quando clicar "Gerar relatório" (ou primeira carga)
 if not run:
     st.info("Ajuste os filtros acima e clique em **Gerar relatório**.")
@@ -187,7 +219,7 @@ if not run:
 # B) WHERE + params
 # ----------------------------
 where = ["event_timestamp between %(start)s and %(end)s"]
-params = {"start": start_dt, "end": end_dt, "limit": limit}
+params = {"start": start_dt, "end": end_dt, "limit": page_rows}
 
 if event_types:
     where.append("event_type_code = any(%(event_types)s)")
@@ -213,77 +245,330 @@ if search:
     params["search"] = f"%{search}%"
 
 # ----------------------------
-# C) COUNT total (para paginação)
-# ----------------------------
-count_sql = f"""
-select count(*) as total
-from {get_events_source()}
-where {' and '.join(where)};
-"""
-total = fetch_df(count_sql, params)[0]["total"]
-pages = max(1, math.ceil(total / limit))
-
-if st.session_state.page > pages:
-    st.session_state.page = pages
-
+# Resultado (total, página, tabela, paginação, exportação) num fragmento:
+# trocar de página / exportar reexecuta só este trecho, sem refazer os
+# filtros e as listas de opções lá de cima.
 # ----------------------------
-# D) Query principal (LIMIT/OFFSET)
-# ----------------------------
-params["offset"] = (st.session_state.page - 1) * limit
-
-sql = f"""
-select
-    event_timestamp,
-
-    concat_ws(' - ',
-    event_type_code::text,
-    event_description
-    ) || chr(10) || access_name as descricao,
-
-    user_name,
-    user_profile,
-
-    unit_group,
-    unit,
-
-    treatment
-from {get_events_source()}
-where {' and '.join(where)}
-order by event_timestamp desc, event_id desc
-limit %(limit)s
-offset %(offset)s;
-"""
-
-df = pd.DataFrame(fetch_df(sql, params))
-
-# ----------------------------
-# E) Render tabela
-# ----------------------------
-if total == 0:
-    st.info("Nenhum evento encontrado para os filtros.")
-else:
-    render_kiper_table(df)
+@st.fragment
+def render_results(where: list, params: dict, filter_key: tuple, limit: int, page_rows: int, virtual_table: bool):
+    # ----------------------------
+    # C) COUNT total (para paginação)
+    # ----------------------------
+    # Total exato fica em cache por filtro (sem o "por página") até a próxima
+    # ingestão: trocar de página nunca reconta.
+    count_key = (get_events_source(), filter_key[:-1])
+    count_sql = f"""
+    select count(*) as total
+    from {get_events_source()}
+    where {' and '.join(where)};
+    """
+    if st.session_state.get("rel_fast_total"):
+        estimate_sql = f"select 1 from {get_events_source()} where {' and '.join(where)}"
+        total, total_exact = fast_total(count_key, count_sql, estimate_sql, params)
+    else:
+        total, total_exact = exact_total(count_key, count_sql, params), True
+
+    pages = max(1, math.ceil(total / page_rows))
+
+    if total_exact and st.session_state.page > pages:
+        st.session_state.page = pages
+    elif not total_exact:
+        # estimativa pode errar para menos: nunca "corta" a página atual
+        pages = max(pages, st.session_state.page)
 
     # ----------------------------
-    # F) Paginação embaixo da tabela
+    # D) Query principal (keyset: busca a partir da chave (event_timestamp, event_id))
     # ----------------------------
-    st.divider()
-    p1, p2, p3 = st.columns([1, 2, 1])
+    # Chaves de fronteira das páginas já vistas, por filtro/fonte:
+    #   first[p] / last[p] = (event_timestamp, event_id) da 1ª / última linha da página p
+    # A ordenação é única, então a página p+1 começa logo depois de last[p] e a
+    # página p-1 termina logo antes de first[p] — sem OFFSET, custo igual em qualquer página.
+    # Exceção: o salto direto para uma página nunca vista (fetch_page_boundary).
+    keys_scope = (filter_key, get_events_source())
+    page_keys = st.session_state.get("rel_page_keys")
+    prefetcher = get_page_prefetcher()
+    if not page_keys or page_keys["scope"] != keys_scope:
+        page_keys = {"scope": keys_scope, "first": {}, "last": {}}
+        st.session_state.rel_page_keys = page_keys
+        prefetcher.cancel_all()
+
+    base_where = " and ".join(where)
+
+    page_select = f"""
+    select
+        event_timestamp,
+        event_id,
+
+        concat_ws(' - ',
+        event_type_code::text,
+        event_description
+        ) || chr(10) || access_name as descricao,
+
+        user_name,
+        user_profile,
+
+        unit_group,
+        unit,
+
+        treatment
+    from {get_events_source()}
+    where {base_where}
+    """
+
+    def key_params(prefix: str, key) -> dict:
+        return {f"{prefix}_ts": key[0], f"{prefix}_id": key[1]}
+
+    # para frente: logo depois da última linha da página anterior
+    forward_sql = (
+        page_select
+        + "and (event_timestamp, event_id) < (%(after_ts)s, %(after_id)s) "
+        + "order by event_timestamp desc, event_id desc limit %(limit)s;"
+    )
+
+    def fetch_page_boundary(page: int):
+        """
+        Chave da última linha da página `page` ainda não vista (salto direto):
+        anda a partir da fronteira conhecida mais próxima antes dela, uma vez só.
+
+        Limitação conhecida: esse passo é um OFFSET, então custa proporcional à
+        distância do salto (só as chaves: com filtros só de período, Index Only
+        Scan em events_ts_id, ~0,3 s por milhão de linhas puladas). Filtros em
+        outras colunas obrigam a ler as linhas. Depois do salto a fronteira
+        fica guardada e a navegação volta a ser por keyset.
+        """
+        known = [p for p in page_keys["last"] if p < page]
+        start = max(known, default=0)
+        q_params = dict(params, skip=(page - start) * page_rows - 1)
+        seek = ""
+        if start:
+            seek = "and (event_timestamp, event_id) < (%(after_ts)s, %(after_id)s)"
+            q_params.update(key_params("after", page_keys["last"][start]))
+        rows = fetch_df(
+            f"""
+            select event_timestamp, event_id
+            from {get_events_source()}
+            where {base_where} {seek}
+            order by event_timestamp desc, event_id desc
+            offset %(skip)s
+            limit 1;
+            """,
+            q_params,
+        )
+        return (rows[0]["event_timestamp"], rows[0]["event_id"]) if rows else None
+
+    page = st.session_state.page
+    if page > 1 and (page - 1) not in page_keys["last"] and (page + 1) not in page_keys["first"]:
+        boundary = fetch_page_boundary(page - 1)
+        if boundary:
+            page_keys["last"][page - 1] = boundary
+        else:
+            # dados mudaram e a página não existe mais
+            page = st.session_state.page = 1
+
+    if page == 1:
+        df = fetch_frame(page_select + "order by event_timestamp desc, event_id desc limit %(limit)s;", params)
+    elif (page - 1) in page_keys["last"]:
+        after = page_keys["last"][page - 1]
+        df = prefetcher.take((keys_scope, after))
+        if df is None:
+            df = fetch_frame(forward_sql, dict(params, **key_params("after", after)))
+    else:
+        # para trás: as `limit` linhas imediatamente antes da 1ª linha da página seguinte
+        df = fetch_frame(
+            page_select
+            + "and (event_timestamp, event_id) > (%(before_ts)s, %(before_id)s) "
+            + "order by event_timestamp asc, event_id asc limit %(limit)s;",
+            dict(params, **key_params("before", page_keys["first"][page + 1])),
+        ).iloc[::-1].reset_index(drop=True)
+
+    if not df.empty:
+        page_keys["first"][page] = (df["event_timestamp"].iloc[0].to_pydatetime(), df["event_id"].iloc[0])
+        page_keys["last"][page] = (df["event_timestamp"].iloc[-1].to_pydatetime(), df["event_id"].iloc[-1])
 
-    with p1:
-        if st.button("⬅️ Anterior", use_container_width=True, disabled=(st.session_state.page <= 1)):
-            st.session_state.page -= 1
-            st.rerun()
+    # ----------------------------
+    # E) Render tabela
+    # ----------------------------
+    # Com total estimado, a última página é descoberta pelos próprios dados
+    has_next = (st.session_state.page < pages) if total_exact else (len(df) == page_rows)
+    total_label = f"{total:,}" if total_exact else f"~{total:,}"
+    pages_label = f"{pages}" if total_exact else f"~{pages}"
+
+    # Páginas "de verdade" (de `limit` linhas) que estão na tela
+    if virtual_table:
+        first_page = (st.session_state.page - 1) * VIRTUAL_BLOCK_PAGES + 1
+        last_page = first_page + max(math.ceil(len(df) / limit), 1) - 1
+        all_pages = max(1, math.ceil(total / limit))
+        all_pages_label = f"{all_pages}" if total_exact else f"~{all_pages}"
+        if last_page > first_page:
+            page_label = f"Páginas <b>{first_page}–{last_page}</b> de <b>{all_pages_label}</b>"
+            page_text = f"páginas {first_page}–{last_page}/{all_pages_label}"
+        else:
+            page_label = f"Página <b>{first_page}</b> de <b>{all_pages_label}</b>"
+            page_text = f"página {first_page}/{all_pages_label}"
+    else:
+        first_page, all_pages = st.session_state.page, pages
+        page_label = f"Página <b>{st.session_state.page}</b> de <b>{pages_label}</b>"
+        page_text = f"página {st.session_state.page}/{pages_label}"
+
+    if not total_exact and total_failed(count_key):
+        st.caption("Não foi possível contar o total exato (a contagem falhou); mostrando a estimativa.")
+    elif not total_exact:
+        @st.fragment(run_every=1.5)
+        def wait_exact_total():
+            # troca a estimativa pelo total exato assim que o count terminar;
+            # se o count falhar, a página refeita não cria mais este fragmento
+            if total_ready(count_key) or total_failed(count_key):
+                st.rerun()
 
-    with p2:
-        st.markdown(
-            f"<div style='text-align:center;'>Página <b>{st.session_state.page}</b> de <b>{pages}</b> • Total: <b>{total:,}</b></div>",
-            unsafe_allow_html=True
+        wait_exact_total()
+
+    if df.empty:
+        st.info("Nenhum evento encontrado para os filtros.")
+    elif virtual_table:
+        render_kiper_table_virtual(
+            df,
+            page_size=int(limit),
+            first_page=first_page,
+            total_pages=all_pages_label,
+            start_page=st.session_state.pop("rel_virtual_start", 0),
         )
+    else:
+        render_kiper_table(df)
+
+    # Com a página na tela, a próxima já vai sendo buscada em segundo plano
+    # (o "Próxima" sai da memória)
+    if len(df) == page_rows:
+        after = page_keys["last"][page]
+        prefetcher.submit((keys_scope, after), forward_sql, dict(params, **key_params("after", after)))
+
+    if not df.empty:
+        # ----------------------------
+        # F) Paginação embaixo da tabela
+        # ----------------------------
+        st.divider()
+        p1, p2, p3 = st.columns([1, 2, 1])
+
+        # Callbacks (e não st.rerun no corpo): a troca de página roda o script uma
+        # vez só, já na página nova — e aproveita a página pré-carregada
+        def prev_page():
+            st.session_state.page -= 1
 
-    with p3:
-        if st.button("Próxima ➡️", use_container_width=True, disabled=(st.session_state.page >= pages)):
+        def next_page():
             st.session_state.page += 1
-            st.rerun()
 
-    st.caption(f"Mostrando {len(df):,} de {total:,} registros (página {st.session_state.page}/{pages})")
\ No newline at end of file
+        with p1:
+            st.button("⬅️ Anterior", use_container_width=True, disabled=(st.session_state.page <= 1), on_click=prev_page)
+
+        with p2:
+            st.markdown(
+                f"<div style='text-align:center;'>{page_label} • Total: <b>{total_label}</b></div>",
+                unsafe_allow_html=True
+            )
+
+            def go_to_page():
+                target = int(st.session_state.rel_goto_page)
+                if virtual_table:
+                    # bloco que contém a página + página dentro do bloco
+                    st.session_state.page = (target - 1) // VIRTUAL_BLOCK_PAGES + 1
+                    st.session_state.rel_virtual_start = (target - 1) % VIRTUAL_BLOCK_PAGES
+                else:
+                    st.session_state.page = target
+
+            st.session_state.rel_goto_page = first_page
+            g1, g2, g3 = st.columns([1, 1, 1])
+            with g2:
+                st.number_input(
+                    "Ir para a página",
+                    min_value=1,
+                    max_value=all_pages,
+                    step=1,
+                    key="rel_goto_page",
+                    on_change=go_to_page,
+                    help="Saltos longos para páginas ainda não vistas podem demorar mais na primeira vez.",
+                    label_visibility="collapsed",
+                )
+
+        with p3:
+            st.button("Próxima ➡️", use_container_width=True, disabled=not has_next, on_click=next_page)
+
+        st.caption(f"Mostrando {len(df):,} de {total_label} registros ({page_text})")
+
+        # ----------------------------
+        # G) Exportar o resultado completo (todas as páginas)
+        # ----------------------------
+        export_sql = f"""
+        select
+            event_timestamp,
+            event_type_code,
+            event_description,
+            access_name,
+            user_name,
+            user_profile,
+            unit_group,
+            unit,
+            treatment
+        from {get_events_source()}
+        where {' and '.join(where)}
+        order by event_timestamp desc, event_id desc;
+        """
+
+        with st.expander("Exportar resultado completo", expanded=False):
+            e1, e2 = st.columns([1.2, 2.8], vertical_alignment="bottom")
+            with e1:
+                export_fmt = st.radio("Formato", list(EXPORT_FORMATS), horizontal=True, key="export_fmt")
+            with e2:
+                st.caption(f"Gera um arquivo com os **{total_label}** eventos dos filtros atuais (sem limite de página).")
+
+            # exportação pronta só vale para os mesmos filtros/fonte/formato
+            export_key = (filter_key, get_events_source(), export_fmt)
+            last_export = st.session_state.get("rel_export")
+            if last_export and last_export["key"] != export_key:
+                # filtros/formato mudaram: o arquivo anterior não serve mais
+                remove_export(last_export["path"])
+                st.session_state.pop("rel_export", None)
+                last_export = None
+
+            if st.button("Gerar arquivo", key="rel_export_run"):
+                if last_export:
+                    remove_export(last_export["path"])
+                st.session_state.pop("rel_export", None)
+                last_export = None
+
+                progress = st.progress(0.0, text="Exportando...")
+
+                def on_batch(rows_done, elapsed):
+                    rate = rows_done / elapsed if elapsed else 0
+                    progress.progress(
+                        min(rows_done / total, 1.0),
+                        text=f"{rows_done:,} de {total_label} linhas • {rate:,.0f} linhas/s",
+                    )
+
+                try:
+                    path, rows = export_query(export_sql, params, export_fmt, on_batch=on_batch)
+                except Exception as e:
+                    progress.empty()
+                    st.error(f"Falha na exportação: {e}")
+                else:
+                    last_export = {"key": export_key, "path": path, "rows": rows}
+                    st.session_state["rel_export"] = last_export
+
+            if last_export and last_export["key"] == export_key and os.path.exists(last_export["path"]):
+                suffix, mime = EXPORT_FORMATS[export_fmt]
+                export_path = last_export["path"]
+                export_mb = os.path.getsize(export_path) / 1024 / 1024
+                st.download_button(
+                    f"Baixar {export_fmt} ({last_export['rows']:,} linhas, {export_mb:,.1f} MB)",
+                    # lido do disco só no clique; daí em diante o Streamlit guarda
+                    # o arquivo inteiro em memória (ver read_export)
+                    data=lambda: read_export(export_path),
+                    file_name=f"eventos_{params['start']:%Y%m%d}_{params['end']:%Y%m%d}{suffix}",
+                    mime=mime,
+                    key="rel_export_download",
+                )
+                if export_mb * 1024 * 1024 > EXPORT_LARGE_BYTES:
+                    st.caption(
+                        "Arquivo grande: o download passa inteiro pela memória do servidor. "
+                        "Prefira Parquet ou um período menor."
+                    )
+
+render_results(where, params, filter_key, int(limit), page_rows, virtual_table)
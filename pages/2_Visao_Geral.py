@@ -3,7 +3,7 @@ import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime, time
 
-from src.db import fetch_df, fetch_distinct_values
+from src.db import fetch_df, fetch_frame, fetch_distinct_values
 from ui.sidebar import render_sidebar_menu
 from src.helpers import init_state, apply_shared_period_to_widgets, sync_shared_period_from_widgets, PERIOD_KEYS
 from src.helpers import ensure_apply_state, apply_filters_now
@@ -12,6 +12,9 @@ from src.helpers import KIPER_PROFILE_COLORS, get_profile_color, canonical_profi
 def get_events_source() -> str:
     return "public.events" if st.session_state.get("data_mode") == "real" else "public.vw_events_anon"
 
+# Passagens classificadas: tabela mantida pela ingestão (src/passages.py)
+PASSAGES_TABLE = "public.passage_classification_v5"
+
 @st.cache_data(ttl=120, show_spinner=False)
 def q_one(sql: str, params: dict):
     rows = fetch_df(sql, params)
@@ -19,7 +22,7 @@ def q_one(sql: str, params: dict):
 
 @st.cache_data(ttl=120, show_spinner=False)
 def q_df(sql: str, params: dict):
-    return pd.DataFrame(fetch_df(sql, params))
+    return fetch_frame(sql, params)
 
 st.set_page_config(page_title="Visão Geral • Hype", layout="wide")
 
@@ -200,8 +203,8 @@ if search:
 
 where_sql = " and ".join(where)
 
-# --- KPIs de PASSAGENS (vw_passage_classification_v5) ---
-view_cols = fetch_view_columns("public", "vw_passage_classification_v5")
+# --- KPIs de PASSAGENS (passage_classification_v5) ---
+view_cols = fetch_view_columns(*PASSAGES_TABLE.split("."))
 
 # Mapeia nomes possíveis (pra você não ficar refém do nome exato da coluna)
 def pick_col(*candidates):
@@ -225,7 +228,7 @@ if col_ts_start:
     where_p.append(f"{col_ts_start} between %(start)s and %(end)s")
     params_p.update({"start": start_dt, "end": end_dt})
 else:
-    st.error("Não encontrei coluna de início da passagem na view vw_passage_classification_v5.")
+    st.error(f"Não encontrei coluna de início da passagem em {PASSAGES_TABLE}.")
     st.stop()
 
 if accesses and col_access:
@@ -259,7 +262,7 @@ with base as (
     date({col_ts_start}) as dia,
     nullif(lower(trim({col_search_1})), '') as user_name,
     {col_profile} as user_profile
-  from public.mv_passage_classification_v5
+  from {PASSAGES_TABLE}
   where {where_p_sql}
 ),
 pessoas as (
@@ -329,13 +332,13 @@ select
   date_trunc('day', open_ts) as dia,
   count(*)::bigint as passagens,
   count(distinct nullif(lower(trim(user_name)), ''))::bigint as pessoas_unicas
-from public.vw_passage_classification_v5
+from {PASSAGES_TABLE}
 where {where_p_sql}
 group by 1
 order by 1;
 """
 
-df_day = pd.DataFrame(fetch_df(day_sql, params_p))
+df_day = fetch_frame(day_sql, params_p)
 
 if df_day.empty:
     st.info("Sem dados no período selecionado.")
@@ -435,7 +438,7 @@ select
   extract(hour from open_ts)::int as hora,
   sum(case when user_profile = any(%(perfis_morador)s::text[]) then 1 else 0 end)::bigint as moradores,
   sum(case when user_profile <> any(%(perfis_morador)s::text[]) then 1 else 0 end)::bigint as nao_moradores
-from public.vw_passage_classification_v5
+from {PASSAGES_TABLE}
 where {' and '.join(where_peak)}
 group by 1
 order by 1;
@@ -443,12 +446,12 @@ order by 1;
 
 params_peak["perfis_morador"] = list(PERFIS_MORADOR)
 
-df_peak = pd.DataFrame(fetch_df(peak_sql, params_peak))
+df_peak = fetch_frame(peak_sql, params_peak)
 
 check_sql = f"""
 select
   count(*)::bigint as passagens_proprietario
-from public.vw_passage_classification_v5
+from {PASSAGES_TABLE}
 where {where_p_sql}
   and user_profile = 'Proprietário';
 """
@@ -513,12 +516,12 @@ uso_sql = f"""
 select
   unit_group,
   count(*)::bigint as passagens
-from public.vw_passage_classification_v5
+from {PASSAGES_TABLE}
 where {where_p_sql}
 group by 1;
 """
 
-df_uso = pd.DataFrame(fetch_df(uso_sql, params_p))
+df_uso = fetch_frame(uso_sql, params_p)
 
 if df_uso.empty:
     st.info("Sem dados suficientes para análise de uso do prédio.")
@@ -590,13 +593,13 @@ select
   door_access_name,
   coalesce(user_profile, 'Sem perfil') as user_profile,
   count(*)::bigint as passagens
-from public.vw_passage_classification_v5
+from {PASSAGES_TABLE}
 where {where_p_sql}
   and cause_code in (701, 708)
 group by 1, 2;
 """
 
-df_acc = pd.DataFrame(fetch_df(acessos_sql, params_p))
+df_acc = fetch_frame(acessos_sql, params_p)
 df_acc["user_profile"] = df_acc["user_profile"].apply(canonical_profile)
 
 if df_acc.empty:
@@ -1,11 +1,16 @@
 import os
+import time
+from datetime import datetime
 import streamlit as st
 import pandas as pd
+import psycopg2
 
-from src.ingest import normalize_kiper_csv, insert_events
+from src.ingest import read_kiper_csv, normalize_kiper_csv, concat_events, insert_events_bulk, ingest_kiper_csv_streaming, DEFAULT_CHUNKSIZE
+from src.ingest import ingest_kiper_files_parallel, default_ingest_workers, FileAlreadyIngested
+from src.manifest import bytes_content_hash, get_manifest_entry, covered_mask, door_coverage, fetch_covered_ranges, record_manifest
 from ui.sidebar import render_sidebar_menu
 from src.helpers import init_state
-from src.db import refresh_materialized_views
+from src.refresh_job import get_refresh_job
 
 
 init_state()
@@ -25,36 +30,235 @@ uploaded = st.file_uploader(
     accept_multiple_files=True
 )
 
-if uploaded:
+INGEST_MODES = {
+    "Prévia": "Lê tudo, mostra uma prévia e só insere quando você confirmar.",
+    "Streaming (arquivos grandes)": "Lê, normaliza e insere em pedaços, sem carregar o arquivo inteiro na memória. Não mostra prévia.",
+    "Paralelo (muitos arquivos)": "Processa vários arquivos ao mesmo tempo e grava cada um assim que fica pronto. Não mostra prévia.",
+}
+
+ingest_mode = st.radio(
+    "Modo de ingestão",
+    list(INGEST_MODES.keys()),
+    horizontal=True,
+    help="\n\n".join(f"**{k}**: {v}" for k, v in INGEST_MODES.items()),
+)
+
+skip_covered = st.checkbox(
+    "Não enviar linhas de portas/horários já cobertos por arquivos anteriores",
+    value=False,
+    help=(
+        "Mais rápido para exports que se repetem, mas só use se os arquivos já carregados eram exports "
+        "completos: se algum era parcial ou filtrado, os eventos que faltavam nele são descartados."
+    ),
+)
+
+def refresh_views_after_ingest(inserted: int, duplicates: int):
+    msg = f"Ingestão concluída! {inserted:,} eventos novos, {duplicates:,} já existiam."
+    # guardado na sessão: o status da atualização (abaixo) refaz a página quando termina
+    st.session_state["admin_last_ingest"] = msg
+    st.success(msg)
+    if inserted:
+        # passagens em segundo plano (status no fim da página)
+        get_refresh_job().start()
+        st.info("Atualizando passagens em segundo plano — acompanhe em **Atualização das passagens**, abaixo.")
+
+if uploaded and ingest_mode == "Streaming (arquivos grandes)":
+    chunksize = st.number_input(
+        "Linhas por pedaço",
+        min_value=1_000,
+        max_value=500_000,
+        value=DEFAULT_CHUNKSIZE,
+        step=10_000,
+    )
+
+    if st.button("Incorporar ao banco"):
+        inserted = 0
+        duplicates = 0
+
+        for f in uploaded:
+            total_bytes = getattr(f, "size", None)
+            bar = st.progress(0.0, text=f"**{f.name}**: iniciando…")
+
+            def on_chunk(i, rows_read, ins, dup, bytes_read, f=f, bar=bar, total_bytes=total_bytes):
+                frac = min(bytes_read / total_bytes, 1.0) if (bytes_read and total_bytes) else 0.0
+                bar.progress(
+                    frac,
+                    text=f"**{f.name}**: pedaço {i} • {rows_read:,} linhas lidas • {ins:,} novos • {dup:,} duplicados",
+                )
+
+            try:
+                ins, dup = ingest_kiper_csv_streaming(
+                    f, source_file=f.name, chunksize=int(chunksize), on_chunk=on_chunk, skip_covered=skip_covered
+                )
+            except FileAlreadyIngested as e:
+                bar.empty()
+                st.info(f"Arquivo pulado — {e}")
+                continue
+            except ValueError as e:
+                bar.empty()
+                st.error(f"Arquivo **{f.name}** ignorado: {e}")
+                continue
+            bar.progress(1.0, text=f"**{f.name}** → {ins:,} eventos novos • {dup:,} duplicados")
+            inserted += ins
+            duplicates += dup
+
+        refresh_views_after_ingest(inserted, duplicates)
+
+elif uploaded and ingest_mode == "Paralelo (muitos arquivos)":
+    workers = st.number_input(
+        "Processos em paralelo",
+        min_value=1,
+        max_value=max(os.cpu_count() or 1, 1),
+        value=default_ingest_workers(),
+        step=1,
+    )
+
+    if st.button("Incorporar ao banco"):
+        st.caption(f"{len(uploaded)} arquivo(s) • {int(workers)} processo(s)")
+        status_table = st.empty()
+        done_files = []
+
+        def on_file(info):
+            done_files.append({
+                "Arquivo": info["file"],
+                "Status": (
+                    "❌ " + info["error"] if info["error"]
+                    else "⏭️ " + info["skipped"] if info["skipped"]
+                    else "✅"
+                ),
+                "Linhas no CSV": info["rows_raw"],
+                "Eventos válidos": info["events"],
+                "Datas ilegíveis": info["bad_dates"],
+                "Novos": info["inserted"],
+                "Duplicados": info["duplicates"],
+                "Já cobertos (não enviados)": info["covered"],
+                "Leitura (s)": round(info["parse_s"], 2) if info["parse_s"] is not None else None,
+                "Gravação (s)": round(info["load_s"], 2) if info["load_s"] is not None else None,
+            })
+            status_table.dataframe(pd.DataFrame(done_files), use_container_width=True, hide_index=True)
+
+        try:
+            with st.spinner("Processando arquivos…"):
+                inserted, duplicates = ingest_kiper_files_parallel(
+                    uploaded, max_workers=int(workers), on_file=on_file, skip_covered=skip_covered
+                )
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # os arquivos da tabela acima já foram gravados; os demais, não
+            st.error(f"Conexão com o banco falhou no meio da ingestão; envie de novo os arquivos que faltaram. ({e})")
+            st.stop()
+
+        refresh_views_after_ingest(inserted, duplicates)
+
+elif uploaded:
     st.info("Vou ler, normalizar e preparar os eventos antes de inserir.")
     prepared_all = []
+    manifest_pending = {}  # content_hash -> (arquivo, linhas no CSV, cobertura por porta)
+    covered = fetch_covered_ranges() if skip_covered else None
+    already_loaded = 0
 
     for f in uploaded:
-        df_raw = pd.read_csv(f, sep=",")
+        content_hash = bytes_content_hash(f.getvalue())
+        entry = get_manifest_entry(content_hash)
+        if entry is not None or content_hash in manifest_pending:
+            st.info(f"Arquivo **{f.name}** pulado: conteúdo idêntico a um arquivo já carregado.")
+            continue
+
+        try:
+            df_raw = read_kiper_csv(f)
+        except ValueError as e:
+            st.error(f"Arquivo **{f.name}** ignorado: {e}")
+            continue
         df_events = normalize_kiper_csv(df_raw, source_file=f.name)
+        manifest_pending[content_hash] = (f.name, len(df_raw), door_coverage(df_events))
+        bad_dates = df_events.attrs.get("coerced_dates", {}).get("event_timestamp", 0)
+
+        # Opcional: linhas de portas/horários já cobertos por arquivos anteriores não vão ao banco
+        skip = covered_mask(df_events, covered)
+        already_loaded += int(skip.sum())
+        df_events = df_events[~skip]
+
         prepared_all.append(df_events)
-        st.write(f"Arquivo **{f.name}** → {len(df_events):,} eventos válidos")
+        msg = f"Arquivo **{f.name}** → {len(df_events):,} eventos válidos"
+        if bad_dates:
+            msg += f" ({bad_dates:,} com data ilegível descartados)"
+        if skip.any():
+            msg += f" ({int(skip.sum()):,} já cobertos por arquivos anteriores, não serão enviados)"
+        st.write(msg)
 
-    prepared = pd.concat(prepared_all, ignore_index=True) if prepared_all else pd.DataFrame()
+    prepared = concat_events(prepared_all)
 
     st.subheader("Prévia do que será inserido")
     st.dataframe(prepared.head(50), use_container_width=True)
 
     if st.button("Incorporar ao banco"):
-        attempted = insert_events(prepared)
-
-        try:
-            with st.spinner("Atualizando visões agregadas…"):
-                refresh_materialized_views()
-            # limpa caches de dados (Visão Geral / Relatórios)
-            st.cache_data.clear()
-            st.success(f"Ingestão concluída! {attempted:,} linhas processadas e visões atualizadas.")
-        except Exception as e:
-            st.warning("Ingestão feita, mas falhou ao atualizar as visões agregadas.")
-            st.exception(e)
+        inserted, duplicates = insert_events_bulk(prepared)
+        for content_hash, (name, row_count, coverage) in manifest_pending.items():
+            record_manifest(content_hash, name, row_count, coverage)
+        refresh_views_after_ingest(inserted, duplicates + already_loaded)
 
 st.info("Depois do upload, vá em **Relatórios** para consultar e filtrar os eventos.")
 
+# ============================================================
+# Atualização das passagens (job em segundo plano)
+# ============================================================
+
+st.header("Atualização das passagens")
+
+def render_refresh_status():
+    status = get_refresh_job().status()
+    state = status["state"]
+
+    if state == "running":
+        step = "materialized views" if status["step"] == "views" else "passagens"
+        elapsed = time.time() - status["started_at"]
+        st.info(f"⏳ Atualizando {step}… ({elapsed:.0f}s). As páginas continuam lendo os dados anteriores até terminar.")
+    elif state == "done":
+        stats = status["stats"]
+        finished = datetime.fromtimestamp(status["finished_at"]).strftime("%d/%m/%Y %H:%M:%S")
+        msg = (
+            f"Atualizado em {finished}: {stats['passages']:,} passagens recalculadas "
+            f"({stats['windows']:,} janela(s) de porta/horário) em {stats['passages_s']:.1f}s"
+        )
+        if "views_s" in stats:
+            msg += f"; materialized views em {stats['views_s']:.1f}s"
+        st.success(msg + ".")
+    elif state == "error":
+        st.warning("Falhou ao atualizar as passagens (as janelas pendentes ficam para a próxima atualização).")
+        with st.expander("Detalhes do erro"):
+            st.code(status["error"])
+    else:
+        st.caption("Nenhuma atualização rodou desde que o app subiu.")
+
+if "admin_last_ingest" in st.session_state:
+    st.caption(f"Última ingestão nesta sessão: {st.session_state['admin_last_ingest']}")
+
+if get_refresh_job().status()["state"] == "running":
+    @st.fragment(run_every=2)
+    def refresh_status_live():
+        if get_refresh_job().status()["state"] != "running":
+            # terminou: a página refeita já não cria este fragmento (para o polling)
+            st.rerun()
+        render_refresh_status()
+
+    refresh_status_live()
+else:
+    render_refresh_status()
+
+c1, c2 = st.columns(2)
+with c1:
+    if st.button("Atualizar passagens agora"):
+        get_refresh_job().start()
+        st.rerun()
+with c2:
+    # o app não lê as materialized views; refresh delas só para leitores de fora (histórico inteiro)
+    if st.button(
+        "Atualizar também as materialized views",
+        help="mv_passages_v5 / mv_passage_classification_v5 não são usadas pelo app. "
+             "Recalcula o histórico inteiro (CONCURRENTLY, sem travar leitores) — só se alguém de fora lê essas views.",
+    ):
+        get_refresh_job().start(views=True)
+        st.rerun()
+
 
 st.header("Modo de Dados")
 
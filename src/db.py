@@ -1,40 +1,254 @@
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
 import streamlit as st
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 
-@st.cache_resource
-def get_conn():
+def get_database_url() -> str:
     """
-    Abre uma conexão persistente com o PostgreSQL usando a URL do st.secrets.
-    cache_resource evita abrir conexão a cada rerun do Streamlit.
+    URL do PostgreSQL: DATABASE_URL no ambiente (scripts/cron fora do Streamlit)
+    ou, se não houver, st.secrets["database"]["url"] (app).
     """
-    conn = psycopg2.connect(
-        st.secrets["database"]["url"],
-        cursor_factory=RealDictCursor
-    )
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return url
+    return st.secrets["database"]["url"]
 
-    # Recomendado para apps Streamlit (muitas leituras, reruns):
-    # evita ficar preso em transações e reduz chance de "aborted transaction".
-    conn.autocommit = True
-    return conn
+# Tamanho do pool (DB_POOL_MIN / DB_POOL_MAX no ambiente).
+# MIN conexões são abertas na criação do pool; acima disso até MAX são abertas
+# sob demanda. Todas ficam abertas (ociosas) ao voltar para o pool, para os
+# picos de acesso reaproveitarem conexões em vez de reconectar a cada consulta.
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
 
-def fetch_df(sql: str, params=None):
+# Conexão parada há mais que isso leva um "select 1" antes de ser entregue
+DB_POOL_PING_AFTER_S = 30.0
+
+class ConnectionPool:
     """
-    Executa SELECT e retorna lista de dicts (bom para virar DataFrame).
-    Se uma query falhar, faz rollback para não "quebrar" a conexão cacheada.
+    Pool de conexões por processo.
+
+    - checkout bloqueia quando as DB_POOL_MAX conexões estão em uso (em vez de
+      dar erro), então sessões concorrentes rodam em paralelo até o limite e
+      depois esperam a vez;
+    - conexão devolvida fica aberta numa lista de ociosas (até DB_POOL_MAX, o
+      limite dos slots), reutilizada primeiro a mais recente. O
+      ThreadedConnectionPool do psycopg2 fecha tudo acima de minconn na
+      devolução, o que obrigava a reconectar em quase todo checkout
+      concorrente;
+    - health check no checkout: conexão fechada, em transação quebrada ou que
+      falha no ping é descartada e substituída por uma nova (reconexão automática).
     """
-    conn = get_conn()
+
+    def __init__(self, dsn: str, minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX):
+        self._dsn = dsn
+        self._lock = threading.Lock()
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        for _ in range(min(minconn, maxconn)):
+            self._idle.append(self._connect())
+
+    def _connect(self):
+        return psycopg2.connect(self._dsn, cursor_factory=RealDictCursor)
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used > DB_POOL_PING_AFTER_S:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("select 1")
+            except Exception:
+                return False
+        return True
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            for _ in range(3):
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = self._connect()
+                if self._healthy(conn):
+                    # Recomendado para apps Streamlit (muitas leituras, reruns):
+                    # evita ficar preso em transações e reduz chance de "aborted transaction".
+                    conn.autocommit = True
+                    return conn
+                self._discard(conn)
+            raise psycopg2.OperationalError("Não consegui uma conexão saudável com o PostgreSQL.")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if conn.closed or conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+@st.cache_resource
+def get_pool() -> ConnectionPool:
+    """Um pool por processo (cache_resource: sobrevive aos reruns do Streamlit)."""
+    return ConnectionPool(get_database_url())
+
+@contextmanager
+def connection():
+    """
+    Empresta uma conexão do pool só durante o bloco (autocommit ligado).
+    Em erro faz rollback antes de devolver, para a conexão voltar limpa.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
     try:
-        with conn.cursor() as cur:
-            cur.execute(sql, params or {})
-            return cur.fetchall()
+        yield conn
     except Exception:
-        # Essencial quando a conexão é reaproveitada (cache_resource)
         try:
             conn.rollback()
         except Exception:
             pass
         raise
+    finally:
+        pool.putconn(conn)
+
+def _run_query(sql: str, params, consume, cursor_factory=None):
+    """
+    Executa a query numa conexão do pool e devolve consume(cursor).
+    Se a conexão caiu no meio (socket velho), tenta mais uma vez com outra.
+    """
+    for attempt in range(2):
+        with connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=cursor_factory) as cur:
+                    cur.execute(sql, params or {})
+                    return consume(cur)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if attempt or not conn.closed:
+                    raise
+
+def fetch_df(sql: str, params=None):
+    """
+    Executa SELECT e retorna lista de dicts (bom para linhas avulsas / KPIs).
+    Para montar DataFrame, prefira fetch_frame (não cria um dict por linha).
+    """
+    return _run_query(sql, params, lambda cur: cur.fetchall())
+
+# OIDs do pg_type -> dtype da coluna no DataFrame
+_PG_INT_OIDS = {20, 21, 23}                 # int8, int2, int4
+_PG_FLOAT_OIDS = {700, 701, 1700}           # float4, float8, numeric
+_PG_BOOL_OIDS = {16}
+_PG_DATETIME_OIDS = {1082, 1114, 1184}      # date, timestamp, timestamptz
+
+def _column_values(values: tuple, type_code: int):
+    """Uma coluna (tupla de valores do psycopg2) -> array com dtype de verdade."""
+    has_null = None in values
+
+    if type_code in _PG_INT_OIDS:
+        # inteiro com NULL vira Int64 (nullable) em vez de float com NaN
+        return pd.array(values, dtype="Int64") if has_null else np.array(values, dtype=np.int64)
+    if type_code in _PG_FLOAT_OIDS:
+        return np.array(values, dtype=np.float64)  # None -> NaN, Decimal -> float
+    if type_code in _PG_BOOL_OIDS:
+        return pd.array(values, dtype="boolean") if has_null else np.array(values, dtype=bool)
+    if type_code in _PG_DATETIME_OIDS:
+        try:
+            return pd.to_datetime(values)
+        except ValueError:
+            # timestamptz com offsets diferentes (horário de verão etc.)
+            return pd.to_datetime(values, utc=True)
+    return np.array(values, dtype=object)
+
+def rows_to_frame(rows: list[tuple], description) -> pd.DataFrame:
+    """
+    Linhas em tupla + cursor.description -> DataFrame, coluna a coluna
+    (transpõe com zip, sem dict por linha e sem o pandas reinferir tipos).
+    Resultado vazio ainda sai com as colunas certas.
+    """
+    names = [d.name for d in description]
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return pd.DataFrame(
+        {name: _column_values(col, d.type_code) for name, col, d in zip(names, columns, description)},
+        columns=names,
+    )
+
+def fetch_frame(sql: str, params=None) -> pd.DataFrame:
+    """
+    Executa SELECT e retorna DataFrame montado direto das colunas
+    (cursor de tuplas + cursor.description): timestamps em datetime64,
+    inteiros em int64 (Int64 se houver NULL), numeric/float em float64.
+    """
+    return _run_query(
+        sql,
+        params,
+        lambda cur: rows_to_frame(cur.fetchall(), cur.description),
+        cursor_factory=extensions.cursor,
+    )
+
+# Linhas por FETCH no cursor do servidor (DB_STREAM_ITERSIZE no ambiente)
+DEFAULT_STREAM_ITERSIZE = int(os.environ.get("DB_STREAM_ITERSIZE", "20000"))
+
+def stream_query(sql: str, params=None, itersize: int = DEFAULT_STREAM_ITERSIZE, as_frame: bool = True):
+    """
+    Executa SELECT num cursor do servidor (named cursor) e devolve o resultado
+    em lotes de até `itersize` linhas, sem trazer tudo para a memória:
+    - as_frame=True: cada lote é um DataFrame (mesmos dtypes do fetch_frame)
+    - as_frame=False: cada lote é uma lista de dicts (como o fetch_df)
+    Resultado vazio com as_frame=True: um lote vazio, com as colunas e tipos
+    (quem grava arquivo ainda precisa do cabeçalho/schema).
+
+    Segura uma conexão do pool (numa transação só de leitura) enquanto o
+    gerador estiver aberto; fechar/abandonar o gerador libera a conexão.
+    Não há nova tentativa se a conexão cair: parte do resultado já foi entregue.
+    """
+    cursor_factory = extensions.cursor if as_frame else RealDictCursor
+    with connection() as conn:
+        # cursor do servidor só existe dentro de transação
+        conn.autocommit = False
+        try:
+            with conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=cursor_factory) as cur:
+                cur.itersize = itersize
+                cur.execute(sql, params or {})
+                first = True
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        if first and as_frame:
+                            yield rows_to_frame(rows, cur.description)
+                        break
+                    first = False
+                    yield rows_to_frame(rows, cur.description) if as_frame else rows
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
 
 @st.cache_data(ttl=60)
 def fetch_distinct_values(column: str):
@@ -52,21 +266,18 @@ def fetch_distinct_values(column: str):
     rows = fetch_df(sql)
     return [r["value"] for r in rows]
 
+# Ordem de dependência: a classificação é calculada sobre as passagens
+MATERIALIZED_VIEWS = ("public.mv_passages_v5", "public.mv_passage_classification_v5")
+
 def refresh_materialized_views():
     """
-    Atualiza as materialized views após ingestão.
-    Sem CONCURRENTLY para evitar exigência de índice UNIQUE.
+    Atualiza as materialized views, em ordem de dependência. Só sob demanda
+    (botão no Admin): o app não lê essas views e o refresh recalcula o histórico inteiro.
+    CONCURRENTLY (exige o índice UNIQUE de sql_query/generate public-mv_passages_v5):
+    quem está lendo a view continua lendo durante o refresh, sem esperar o lock.
+    Um comando por view, cada um na sua transação (autocommit).
     """
-    sql = """
-    refresh materialized view public.mv_passages_v5;
-    refresh materialized view public.mv_passage_classification_v5;
-    """
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute(sql)
-    try:
-        conn.commit()
-    except Exception:
-        pass
-
-
+    with connection() as conn:
+        with conn.cursor() as cur:
+            for view in MATERIALIZED_VIEWS:
+                cur.execute(f"refresh materialized view concurrently {view};")
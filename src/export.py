@@ -0,0 +1,138 @@
+import os
+import time
+import tempfile
+import pandas as pd
+from src.db import stream_query, DEFAULT_STREAM_ITERSIZE
+
+# Formatos de exportação: rótulo -> (extensão, mime)
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+# Arquivos de exportação mais velhos que isso são apagados na próxima exportação
+# (sessões que fecharam sem gerar outro arquivo)
+EXPORT_MAX_AGE_S = 6 * 3600
+EXPORT_PREFIX = "hype_export_"
+
+# Acima disso o Relatórios avisa do custo do download (ver read_export)
+EXPORT_LARGE_BYTES = 200 * 1024 * 1024
+
+# CSV no padrão que o Excel em pt-BR abre direto
+CSV_SEP = ";"
+CSV_ENCODING = "utf-8-sig"
+
+def _arrow_type(dtype):
+    """dtype do lote -> tipo Arrow estável entre lotes (NULL num lote não muda o schema)."""
+    import pyarrow as pa
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return pa.bool_()
+    if pd.api.types.is_integer_dtype(dtype):
+        return pa.int64()
+    if pd.api.types.is_float_dtype(dtype):
+        return pa.float64()
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return pa.timestamp("us", tz=str(dtype.tz) if getattr(dtype, "tz", None) else None)
+    return pa.string()
+
+class _CsvSink:
+    def __init__(self, path: str):
+        self._f = open(path, "w", encoding=CSV_ENCODING, newline="")
+        self._header = True
+
+    def write(self, df: pd.DataFrame) -> None:
+        df.to_csv(self._f, sep=CSV_SEP, index=False, header=self._header, date_format="%d/%m/%Y %H:%M:%S")
+        self._header = False
+
+    def close(self) -> None:
+        self._f.close()
+
+class _ParquetSink:
+    def __init__(self, path: str):
+        self._path = path
+        self._writer = None
+        self._schema = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._schema = pa.schema([(c, _arrow_type(df[c].dtype)) for c in df.columns])
+            self._writer = pq.ParquetWriter(self._path, self._schema, compression="zstd")
+        self._writer.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        else:
+            # nenhum lote: sem isso o arquivo ficaria com 0 bytes (Parquet inválido)
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            pq.write_table(pa.table({}), self._path, compression="zstd")
+
+def remove_export(path: str | None) -> None:
+    """Apaga um arquivo de exportação (se ainda existir)."""
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def read_export(path: str) -> bytes:
+    """
+    Conteúdo do arquivo de exportação (arquivo fechado ao sair).
+
+    Limitação: o download do Streamlit (st.download_button) só aceita bytes e
+    o media file manager guarda essa cópia em memória enquanto o botão
+    existe. A geração (export_query) nunca segura o resultado inteiro, mas o
+    download segura o arquivo pronto, no tamanho do arquivo (Parquet
+    comprimido costuma ser bem menor que o CSV). O Streamlit não tem como
+    servir um arquivo do disco em streaming (o static serving recusa arquivos
+    acima de 200 MB).
+    """
+    with open(path, "rb") as fh:
+        return fh.read()
+
+def cleanup_old_exports(max_age_s: float = EXPORT_MAX_AGE_S) -> None:
+    """Apaga exportações antigas largadas no diretório temporário."""
+    tmp = tempfile.gettempdir()
+    now = time.time()
+    for entry in os.scandir(tmp):
+        if not entry.name.startswith(EXPORT_PREFIX):
+            continue
+        try:
+            if now - entry.stat().st_mtime > max_age_s:
+                os.remove(entry.path)
+        except OSError:
+            pass  # outro processo apagou/está usando
+
+def export_query(sql: str, params, fmt: str, on_batch=None, itersize: int = DEFAULT_STREAM_ITERSIZE) -> tuple[str, int]:
+    """
+    Grava o resultado inteiro do SELECT num arquivo temporário (CSV ou Parquet),
+    lote a lote a partir do cursor do servidor: só um lote fica em memória.
+
+    on_batch(rows_done, elapsed_s) é chamado a cada lote (progresso/linhas/s).
+    Retorna (caminho do arquivo, linhas). Em erro o arquivo é apagado.
+    Quem chamou apaga o arquivo quando ele deixa de servir (remove_export);
+    os esquecidos somem depois de EXPORT_MAX_AGE_S (cleanup_old_exports).
+    """
+    cleanup_old_exports()
+    suffix, _ = EXPORT_FORMATS[fmt]
+    fd, path = tempfile.mkstemp(prefix=EXPORT_PREFIX, suffix=suffix)
+    os.close(fd)
+
+    sink = _ParquetSink(path) if fmt == "Parquet" else _CsvSink(path)
+    rows = 0
+    t0 = time.perf_counter()
+    try:
+        for df in stream_query(sql, params, itersize=itersize):
+            sink.write(df)
+            rows += len(df)
+            if on_batch:
+                on_batch(rows, time.perf_counter() - t0)
+    except BaseException:
+        sink.close()
+        os.remove(path)
+        raise
+    sink.close()
+    return path, rows
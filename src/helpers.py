@@ -1,5 +1,6 @@
 from __future__ import annotations
 import streamlit as st
+import numpy as np
 import pandas as pd
 import html
 import json
@@ -10,7 +11,7 @@ import streamlit.components.v1 as components
 import plotly.graph_objects as go
 
 from src.ingest import normalize_kiper_csv, insert_events
-from src.db import fetch_df, fetch_distinct_values
+from src.db import fetch_df, fetch_frame, fetch_distinct_values
 
 # ============================================================
 # Helpers: opções + UI
@@ -303,9 +304,98 @@ def kiper_badge(profile: str) -> str:
     bg = get_profile_color(canon, "#607d8b")
     return f"<span class='badge' style='background:{bg};'>{html.escape(canon)}</span>"
 
-def render_kiper_table(df_raw: pd.DataFrame) -> None:
-    """Tabela estilo Kiper via components.html (iframe)."""
-    css = """
+def _text_values(df: pd.DataFrame, col: str, strip: bool = True) -> list[str]:
+    """Coluna como lista de textos (nulo -> ""), o equivalente de str(x or "").strip()."""
+    if col not in df.columns:
+        return [""] * len(df)
+    out = ["" if (v is None or v != v or not v) else str(v) for v in df[col].tolist()]
+    return [v.strip() for v in out] if strip else out
+
+def _escape_values(values: list[str]) -> list[str]:
+    """html.escape na coluna inteira, uma vez por valor distinto."""
+    memo = {v: html.escape(v) for v in set(values)}
+    return [memo[v] for v in values]
+
+def _date_time_values(df: pd.DataFrame) -> tuple[list[str], list[str]]:
+    """
+    event_timestamp -> ("dd/mm/aaaa", "HH:MM:SS") por linha ("" se nulo): um
+    datetime_as_string (numpy) para a coluna toda em vez de 2 strftime por linha.
+    """
+    if "event_timestamp" not in df.columns:
+        return [""] * len(df), [""] * len(df)
+    ts = pd.to_datetime(df["event_timestamp"])
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)  # hora "de parede", como o strftime
+    iso = np.datetime_as_string(ts.to_numpy(dtype="datetime64[s]"), unit="s").tolist()
+    date_str = ["" if v == "NaT" else f"{v[8:10]}/{v[5:7]}/{v[:4]}" for v in iso]
+    time_str = ["" if v == "NaT" else v[11:19] for v in iso]
+    return date_str, time_str
+
+# Linha da tabela; os {} recebem as colunas já formatadas em _kiper_rows_html
+_KIPER_ROW_TEMPLATE = """
+            <tr class="row-hover">
+              <td class="col-date">
+                <div class="cell-stack">
+                  <div>{}</div>
+                  <div class="kiper-muted">{}</div>
+                </div>
+              </td>
+              <td class="col-desc">{}</td>
+              <td class="col-user">{}</td>
+              <td class="col-gu">{}</td>
+              <td class="col-reg">{}</td>
+            </tr>
+            """
+
+def _kiper_rows_html(df_raw: pd.DataFrame) -> str:
+    """
+    <tr> de todas as linhas, montados por coluna (formata/escapa cada coluna
+    inteira de uma vez, badge calculado uma vez por perfil) e unidos num join só.
+    """
+    if df_raw.empty:
+        return ""
+
+    date_str, time_str = _date_time_values(df_raw)
+
+    # Descrição: linhas separadas por \n (linhas vazias somem)
+    desc = _text_values(df_raw, "descricao", strip=False)
+    desc_memo = {
+        d: "".join(f"<p class='kiper-line'>{html.escape(line)}</p>" for line in d.split("\n") if line)
+        for d in set(desc)
+    }
+    desc_html = [desc_memo[d] for d in desc]
+
+    # Disparado por: nome + badge (um kiper_badge por perfil distinto)
+    user_name = _text_values(df_raw, "user_name")
+    user_profile = _text_values(df_raw, "user_profile")
+    name_esc = _escape_values(user_name)
+    badges = {p: kiper_badge(p) for p in set(user_profile) if p}
+    user_html = [
+        "<div class='cell-stack'>"
+        + (f"<span class='kiper-name'>{ne}</span>" if n else "")
+        + badges.get(p, "")
+        + "</div>"
+        if (n or p) else ""
+        for n, ne, p in zip(user_name, name_esc, user_profile)
+    ]
+
+    # GU + Unidade (2 linhas)
+    ug = _text_values(df_raw, "unit_group")
+    un = _text_values(df_raw, "unit")
+    gu_html = [
+        "<div class='cell-stack'>"
+        + (f"<p class='kiper-line'>{ge}</p>" if g else "")
+        + (f"<p class='kiper-line'>{ue}</p>" if u else "")
+        + "</div>"
+        for g, ge, u, ue in zip(ug, _escape_values(ug), un, _escape_values(un))
+    ]
+
+    # Registro do evento
+    reg_html = [f"<p class='kiper-line'>{t}</p>" for t in _escape_values(_text_values(df_raw, "treatment"))]
+
+    return "".join(map(_KIPER_ROW_TEMPLATE.format, date_str, time_str, desc_html, user_html, gu_html, reg_html))
+
+_KIPER_TABLE_CSS = """
     <style>
       body { font-family: Inter, system-ui, Arial; margin: 0; }
       .kiper-wrap { width: 100%; }
@@ -361,76 +451,9 @@ def render_kiper_table(df_raw: pd.DataFrame) -> None:
       .col-gu { width: 220px; }
       .col-reg { width: auto; }
     </style>
-    """
-
-    rows_html = []
-    for _, r in df_raw.iterrows():
-        dt = r.get("event_timestamp")
-        if pd.notnull(dt):
-            date_str = dt.strftime("%d/%m/%Y")
-            time_str = dt.strftime("%H:%M:%S")
-        else:
-            date_str, time_str = "", ""
-
-        # Descrição: linhas separadas por \n
-        desc_lines = str(r.get("descricao") or "").split("\n")
-        desc_html = "".join(
-            [f"<p class='kiper-line'>{html.escape(line)}</p>" for line in desc_lines if line]
-        )
-
-        # Disparado por: nome + badge
-        user_name = str(r.get("user_name") or "").strip()
-        user_profile = str(r.get("user_profile") or "").strip()
-
-        user_html_parts = []
-        if user_name:
-            user_html_parts.append(f"<span class='kiper-name'>{html.escape(user_name)}</span>")
-        if user_profile:
-            user_html_parts.append(kiper_badge(user_profile))
-        user_html = (
-            "<div class='cell-stack'>" + "".join(user_html_parts) + "</div>"
-            if user_html_parts else ""
-        )
-
-        # GU + Unidade (2 linhas)
-        ug = str(r.get("unit_group") or "").strip()
-        un = str(r.get("unit") or "").strip()
-
-        gu_html = "<div class='cell-stack'>"
-        if ug:
-            gu_html += f"<p class='kiper-line'>{html.escape(ug)}</p>"
-        if un:
-            gu_html += f"<p class='kiper-line'>{html.escape(un)}</p>"
-        gu_html += "</div>"
+"""
 
-        # Registro do evento
-        treatment = str(r.get("treatment") or "").strip()
-        reg_html = f"<p class='kiper-line'>{html.escape(treatment)}</p>"
-
-        rows_html.append(
-            f"""
-            <tr class="row-hover">
-              <td class="col-date">
-                <div class="cell-stack">
-                  <div>{html.escape(date_str)}</div>
-                  <div class="kiper-muted">{html.escape(time_str)}</div>
-                </div>
-              </td>
-              <td class="col-desc">{desc_html}</td>
-              <td class="col-user">{user_html}</td>
-              <td class="col-gu">{gu_html}</td>
-              <td class="col-reg">{reg_html}</td>
-            </tr>
-            """
-        )
-
-    table_html = f"""
-    <html>
-      <head>{css}</head>
-      <body>
-        <div class="kiper-wrap">
-          <table class="kiper-table">
-            <thead>
+_KIPER_TABLE_HEAD = """<thead>
               <tr>
                 <th class="col-date">Data da ocorrência</th>
                 <th class="col-desc">Descrição</th>
@@ -438,13 +461,208 @@ def render_kiper_table(df_raw: pd.DataFrame) -> None:
                 <th class="col-gu">GU + Unidade</th>
                 <th class="col-reg">Registro do evento</th>
               </tr>
-            </thead>
+            </thead>"""
+
+def kiper_table_html(df_raw: pd.DataFrame) -> str:
+    """HTML completo (css + tabela) da tabela estilo Kiper."""
+    rows_html = _kiper_rows_html(df_raw)
+
+    table_html = f"""
+    <html>
+      <head>{_KIPER_TABLE_CSS}</head>
+      <body>
+        <div class="kiper-wrap">
+          <table class="kiper-table">
+            {_KIPER_TABLE_HEAD}
             <tbody>
-              {''.join(rows_html)}
+              {rows_html}
             </tbody>
           </table>
         </div>
       </body>
     </html>
     """
-    components.html(table_html, height=750, scrolling=True)
\ No newline at end of file
+    return table_html
+
+def render_kiper_table(df_raw: pd.DataFrame) -> None:
+    """Tabela estilo Kiper via components.html (iframe)."""
+    components.html(kiper_table_html(df_raw), height=750, scrolling=True)
+
+# Tabela virtualizada: só as linhas visíveis (+ folga) ficam no DOM
+_KIPER_VIRTUAL_JS = """
+(function () {
+  const data = JSON.parse(document.getElementById("kiper-data").textContent);
+  const rows = data.rows, badges = data.badges, pageSize = data.page_size;
+  const pages = Math.max(1, Math.ceil(rows.length / pageSize));
+  const EST_ROW = 80, OVERSCAN = 6;
+
+  const scroller = document.getElementById("kiper-scroll");
+  const body = document.getElementById("kiper-body");
+  const head = scroller.querySelector("thead");
+  const prev = document.getElementById("kiper-prev");
+  const next = document.getElementById("kiper-next");
+  const label = document.getElementById("kiper-label");
+
+  const heights = new Array(rows.length);
+  let page = 0;
+  let frame = 0;
+
+  const ESC = {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"};
+  const esc = (s) => s.replace(/[&<>"']/g, (c) => ESC[c]);
+
+  function rowHtml(i) {
+    const [d, t, desc, name, badge, ug, un, reg] = rows[i];
+    const descHtml = desc.split("\\n").filter((l) => l).map((l) => `<p class='kiper-line'>${esc(l)}</p>`).join("");
+    let user = "";
+    if (name || badge >= 0) {
+      user = "<div class='cell-stack'>"
+        + (name ? `<span class='kiper-name'>${esc(name)}</span>` : "")
+        + (badge >= 0 ? `<span class='badge' style='background:${badges[badge][1]};'>${esc(badges[badge][0])}</span>` : "")
+        + "</div>";
+    }
+    const gu = "<div class='cell-stack'>"
+      + (ug ? `<p class='kiper-line'>${esc(ug)}</p>` : "")
+      + (un ? `<p class='kiper-line'>${esc(un)}</p>` : "")
+      + "</div>";
+    return `<tr class="row-hover" data-i="${i}">`
+      + `<td class="col-date"><div class="cell-stack"><div>${esc(d)}</div><div class="kiper-muted">${esc(t)}</div></div></td>`
+      + `<td class="col-desc">${descHtml}</td><td class="col-user">${user}</td>`
+      + `<td class="col-gu">${gu}</td><td class="col-reg"><p class='kiper-line'>${esc(reg)}</p></td></tr>`;
+  }
+
+  const spacer = (h) => h > 0 ? `<tr><td colspan="5" style="height:${h}px;padding:0;border:0;"></td></tr>` : "";
+
+  function render(measure = true) {
+    const first = page * pageSize, n = Math.min(pageSize, rows.length - first);
+    const off = new Array(n + 1);
+    off[0] = 0;
+    for (let k = 0; k < n; k++) off[k + 1] = off[k] + (heights[first + k] || EST_ROW);
+
+    const top = Math.max(0, scroller.scrollTop - head.offsetHeight);
+    const bottom = top + scroller.clientHeight;
+    let a = 0;
+    while (a < n && off[a + 1] < top) a++;
+    let b = a;
+    while (b < n && off[b] < bottom) b++;
+    a = Math.max(0, a - OVERSCAN);
+    b = Math.min(n, b + OVERSCAN);
+
+    let html = spacer(off[a]);
+    for (let k = a; k < b; k++) html += rowHtml(first + k);
+    body.innerHTML = html + spacer(off[n] - off[b]);
+
+    // alturas reais das linhas desenhadas (descrição/badge mudam a altura)
+    let changed = false;
+    body.querySelectorAll("tr[data-i]").forEach((tr) => {
+      const i = +tr.dataset.i, h = tr.offsetHeight;
+      if (heights[i] !== h) { heights[i] = h; changed = true; }
+    });
+    if (changed && measure) render(false);
+  }
+
+  function showPage(p) {
+    page = Math.min(Math.max(p, 0), pages - 1);
+    scroller.scrollTop = 0;
+    render();
+    label.innerHTML = `Página <b>${data.first_page + page}</b> de <b>${data.total_pages}</b>`;
+    prev.disabled = page <= 0;
+    next.disabled = page >= pages - 1;
+  }
+
+  scroller.addEventListener("scroll", () => {
+    if (!frame) frame = requestAnimationFrame(() => { frame = 0; render(); });
+  });
+  prev.addEventListener("click", () => showPage(page - 1));
+  next.addEventListener("click", () => showPage(page + 1));
+  showPage(data.start_page);
+})();
+"""
+
+def kiper_table_payload(df_raw: pd.DataFrame) -> dict:
+    """
+    Linhas da tabela em JSON compacto (uma lista por linha, textos crus; o
+    navegador escapa). Badge vai como índice numa lista de (perfil, cor).
+    """
+    date_str, time_str = _date_time_values(df_raw)
+    user_profile = _text_values(df_raw, "user_profile")
+    badge_list = sorted({p for p in user_profile if p})
+    badge_idx = {p: i for i, p in enumerate(badge_list)}
+    badges = []
+    for p in badge_list:
+        canon = canonical_profile(p)
+        badges.append([canon, get_profile_color(canon, "#607d8b")])
+
+    rows = [
+        list(r)
+        for r in zip(
+            date_str,
+            time_str,
+            _text_values(df_raw, "descricao", strip=False),
+            _text_values(df_raw, "user_name"),
+            [badge_idx.get(p, -1) for p in user_profile],
+            _text_values(df_raw, "unit_group"),
+            _text_values(df_raw, "unit"),
+            _text_values(df_raw, "treatment"),
+        )
+    ]
+    return {"rows": rows, "badges": badges}
+
+def render_kiper_table_virtual(
+    df_raw: pd.DataFrame,
+    page_size: int,
+    first_page: int = 1,
+    total_pages: int | str = "",
+    start_page: int = 0,
+) -> None:
+    """
+    Tabela estilo Kiper (mesmo css/colunas) com rolagem virtual no navegador.
+    df_raw pode ter várias páginas: elas são paginadas no próprio iframe, sem
+    rerun. first_page = número da 1ª página do bloco (para o rótulo);
+    start_page = página do bloco aberta primeiro (0 = primeira).
+    """
+    payload = kiper_table_payload(df_raw)
+    payload.update(
+        page_size=int(page_size),
+        first_page=int(first_page),
+        total_pages=str(total_pages),
+        start_page=int(start_page),
+    )
+    # "<" escapado: texto como "</script>" ou "<!--" no dado não pode mexer na tag <script>
+    payload_json = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).replace("<", "\\u003c")
+
+    table_html = f"""
+    <html>
+      <head>{_KIPER_TABLE_CSS}
+        <style>
+          #kiper-scroll {{ height: 690px; overflow-y: auto; }}
+          .kiper-pager {{
+            display:flex; align-items:center; justify-content:center; gap: 16px;
+            padding: 8px 0; font-family: Inter, system-ui, Arial; font-size: 14px; color:#444;
+          }}
+          .kiper-pager button {{
+            border:1px solid #ddd; background:#fff; border-radius: 8px;
+            padding: 4px 14px; cursor:pointer; font-size: 13px;
+          }}
+          .kiper-pager button:disabled {{ opacity: .4; cursor: default; }}
+        </style>
+      </head>
+      <body>
+        <div class="kiper-wrap">
+          <div id="kiper-scroll">
+            <table class="kiper-table">
+              {_KIPER_TABLE_HEAD}
+              <tbody id="kiper-body"></tbody>
+            </table>
+          </div>
+          <div class="kiper-pager">
+            <button id="kiper-prev">⬅️ Anterior</button>
+            <span id="kiper-label"></span>
+            <button id="kiper-next">Próxima ➡️</button>
+          </div>
+        </div>
+        <script id="kiper-data" type="application/json">{payload_json}</script>
+        <script>{_KIPER_VIRTUAL_JS}</script>
+      </body>
+    </html>
+    """
+    components.html(table_html, height=750, scrolling=False)
@@ -1,7 +1,25 @@
+import io
+import os
+import csv
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import hashlib
+import logging
+import psycopg2
+import psycopg2.errors
 from psycopg2.extras import execute_values
-from src.db import get_conn
+from src.db import connection
+from src.passages import mark_dirty
+from src.manifest import (
+    file_content_hash, bytes_content_hash, get_manifest_entry, fetch_covered_ranges,
+    covered_mask, door_coverage, combine_coverage, record_manifest,
+)
+
+logger = logging.getLogger(__name__)
 
 CSV_COLUMNS = [
     "Data do evento",
@@ -18,25 +36,279 @@ CSV_COLUMNS = [
     "Tratamento",
 ]
 
+class FileAlreadyIngested(Exception):
+    """Arquivo com o mesmo conteúdo (sha256) já está no ingest_manifest."""
+    def __init__(self, source_file: str, entry: dict):
+        self.source_file = source_file
+        self.entry = entry
+        super().__init__(
+            f"{source_file}: conteúdo idêntico a '{entry['source_file']}', "
+            f"já carregado em {entry['ingested_at']:%d/%m/%Y %H:%M}."
+        )
+
+# Colunas de public.events, na ordem do INSERT/COPY
+EVENT_COLUMNS = [
+    "event_id",
+    "event_timestamp",
+    "treatment_finished_at",
+    "event_type_code",
+    "event_description",
+    "access_name",
+    "user_name",
+    "user_profile",
+    "unit_group",
+    "unit",
+    "handler_profile",
+    "handler_name",
+    "treatment",
+    "source_file",
+]
+
+# Linhas por pedaço no modo streaming (leitura -> normalização -> INSERT)
+DEFAULT_CHUNKSIZE = 50_000
+
 def _sha1(text: str) -> str:
     return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
-def read_kiper_csv(uploaded_file) -> pd.DataFrame:
+# Colunas que compõem a chave de dedup (ordem importa: muda o hash!)
+EVENT_KEY_COLUMNS = ["event_timestamp", "access_name", "event_description", "user_name", "unit", "event_type_code"]
+
+def _key_part(col: pd.Series) -> pd.Series:
+    """
+    Converte uma coluna inteira para o mesmo texto que str(v) geraria
+    valor a valor ("" para nulos).
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        # strftime em bloco; str(Timestamp) só mostra fração quando ela existe,
+        # então essas (raras) linhas seguem pelo caminho escalar.
+        txt = col.dt.strftime("%Y-%m-%d %H:%M:%S")
+        frac = col.notna() & ((col.dt.microsecond != 0) | (col.dt.nanosecond != 0))
+        if frac.any():
+            txt = txt.astype(object)
+            txt[frac] = col[frac].map(str)
+        return txt.astype("string").fillna("")
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # converte só as categorias e expande pelos códigos (-1 = nulo -> "")
+        cats = col.cat.categories.astype("string").to_numpy(dtype=object)
+        codes = col.cat.codes.to_numpy()
+        txt = np.append(cats, "")[codes]
+        return pd.Series(txt, index=col.index, dtype="string")
+    return col.astype("string").fillna("")
+
+def build_event_ids(df: pd.DataFrame) -> pd.Series:
+    """
+    Gera o event_id (sha1 de EVENT_KEY_COLUMNS unidas por "|") por coluna,
+    sem chamar Python linha a linha. Mesmo digest da versão antiga com
+    df.apply(make_key, axis=1), então o ON CONFLICT (event_id) continua valendo.
+    """
+    if df.empty:
+        return pd.Series([], index=df.index, dtype=object)
+
+    parts = [_key_part(df[c]) for c in EVENT_KEY_COLUMNS]
+    joined = parts[0].str.cat(parts[1:], sep="|")
+
+    return pd.Series(
+        [_sha1(k) for k in joined.tolist()],
+        index=df.index,
+        dtype=object,
+    )
+
+# Bytes lidos do início do arquivo para descobrir separador/encoding
+SNIFF_BYTES = 64 * 1024
+
+def _decode_sample(sample: bytes) -> tuple[str, str]:
+    """Decide o encoding pela amostra: BOM -> utf-8-sig, utf-8 válido -> utf-8, senão latin1."""
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return sample[3:].decode("utf-8", errors="ignore"), "utf-8-sig"
+    try:
+        return sample.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError as e:
+        # amostra pode ter cortado um caractere multibyte bem no final
+        if e.start >= len(sample) - 3:
+            return sample[:e.start].decode("utf-8"), "utf-8"
+    return sample.decode("latin1"), "latin1"
+
+def sniff_kiper_csv(uploaded_file, sample_bytes: int = SNIFF_BYTES) -> tuple[str, str]:
     """
-    Lê o CSV exportado do Kiper tentando os formatos mais comuns.
+    Descobre (sep, encoding) do CSV do Kiper olhando só o cabeçalho da amostra,
+    sem parsear o arquivo. Devolve o stream posicionado no início.
     """
-    # uploaded_file é um stream do Streamlit. Vamos tentar algumas combinações.
+    uploaded_file.seek(0)
+    sample = uploaded_file.read(sample_bytes)
+    uploaded_file.seek(0)
+
+    if isinstance(sample, str):  # stream de texto (já decodificado)
+        text, enc = sample, None
+    else:
+        text, enc = _decode_sample(sample)
+
+    header_line = text.splitlines()[0] if text else ""
+
+    best_sep, best_fields = None, []
     for sep in [",", ";"]:
-        for enc in ["utf-8", "latin1"]:
-            try:
-                uploaded_file.seek(0)
-                df = pd.read_csv(uploaded_file, sep=sep, encoding=enc)
-                if "Data do evento" in df.columns:
-                    return df
-            except Exception:
-                pass
+        fields = next(csv.reader([header_line], delimiter=sep), [])
+        if sum(f in CSV_COLUMNS for f in fields) > sum(f in CSV_COLUMNS for f in best_fields):
+            best_sep, best_fields = sep, fields
+
+    if "Data do evento" not in best_fields:
+        raise ValueError(
+            "Não consegui identificar o CSV do Kiper: o cabeçalho não tem a coluna "
+            f"'Data do evento' com separador ',' ou ';' (encoding detectado: {enc or 'texto'}). "
+            f"Cabeçalho lido: {header_line[:200]!r}"
+        )
+
+    return best_sep, enc
+
+def read_kiper_csv(uploaded_file) -> pd.DataFrame:
+    """
+    Lê o CSV exportado do Kiper: detecta separador/encoding pelo cabeçalho
+    e faz um único parse completo.
+    """
+    sep, enc = sniff_kiper_csv(uploaded_file)
+    try:
+        return pd.read_csv(uploaded_file, sep=sep, encoding=enc)
+    except UnicodeDecodeError as e:
+        raise ValueError(
+            f"O CSV parecia {enc} pelo cabeçalho, mas tem bytes inválidos mais adiante ({e}). "
+            "Reexporte o arquivo do Kiper com um único encoding."
+        ) from e
+
+def iter_kiper_csv_chunks(uploaded_file, chunksize: int = DEFAULT_CHUNKSIZE):
+    """
+    Lê o CSV do Kiper em pedaços de `chunksize` linhas (DataFrames crus,
+    mesmas colunas do read_kiper_csv). Memória fica proporcional ao chunk.
+    """
+    sep, enc = sniff_kiper_csv(uploaded_file)
+    with pd.read_csv(uploaded_file, sep=sep, encoding=enc, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
 
-    raise ValueError("Não consegui ler o CSV (separador/encoding inesperado).")
+# Formatos de data vistos nas exportações do Kiper (o primeiro é o padrão)
+KIPER_TIMESTAMP_FORMATS = [
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y",
+    "%d/%m/%y %H:%M:%S",
+    "%d-%m-%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+]
+
+def detect_timestamp_format(values: pd.Series, sample_size: int = 500) -> str | None:
+    """Formato (de KIPER_TIMESTAMP_FORMATS) que mais acerta numa amostra da coluna."""
+    sample = values.dropna().head(sample_size)
+    if sample.empty:
+        return None
+
+    best_fmt, best_ok = None, 0
+    for fmt in KIPER_TIMESTAMP_FORMATS:
+        ok = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+        if ok > best_ok:
+            best_fmt, best_ok = fmt, ok
+        if ok == len(sample):
+            break
+    return best_fmt
+
+# Largura fixa de cada diretiva aceita no caminho rápido (valores com zero à esquerda)
+_FIXED_WIDTH_DIRECTIVES = {"d": 2, "m": 2, "Y": 4, "H": 2, "M": 2, "S": 2}
+
+def _fixed_width_layout(fmt: str):
+    """
+    "%d/%m/%Y %H:%M:%S" -> ([(diretiva, início, largura)], [(posição, literal)], largura total).
+    None se o formato tiver diretiva fora de _FIXED_WIDTH_DIRECTIVES.
+    """
+    fields, literals, pos, i = [], [], 0, 0
+    while i < len(fmt):
+        if fmt[i] == "%":
+            d = fmt[i + 1:i + 2]
+            if d not in _FIXED_WIDTH_DIRECTIVES:
+                return None
+            fields.append((d, pos, _FIXED_WIDTH_DIRECTIVES[d]))
+            pos += _FIXED_WIDTH_DIRECTIVES[d]
+            i += 2
+        else:
+            literals.append((pos, fmt[i]))
+            pos += 1
+            i += 1
+    return fields, literals, pos
+
+def _parse_fixed_width(values: pd.Series, fmt: str) -> pd.Series | None:
+    """
+    Parse vetorizado (numpy) de datas em largura fixa: lê os dígitos direto
+    dos code points, sem strptime por elemento. Linhas fora do padrão exato
+    (largura, separadores, dígitos, data inexistente) saem NaT. None se o
+    formato não for de largura fixa.
+    """
+    layout = _fixed_width_layout(fmt)
+    if layout is None:
+        return None
+    fields, literals, width = layout
+
+    obj = values.to_numpy(dtype=object)
+    is_str = np.fromiter((isinstance(v, str) for v in obj), dtype=bool, count=len(obj))
+    # width+1: texto maior que o formato não cabe e é barrado pelo tamanho
+    text = np.where(is_str, obj, "").astype(f"U{width + 1}")
+    ok = is_str & (np.char.str_len(text) == width)
+    chars = text.view(np.uint32).reshape(len(text), width + 1)[:, :width].astype(np.int64)
+
+    for p, lit in literals:
+        ok &= chars[:, p] == ord(lit)
+
+    parts = {}
+    for d, start, w in fields:
+        digits = chars[:, start:start + w] - ord("0")
+        ok &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+        parts[d] = digits @ (10 ** np.arange(w - 1, -1, -1))
+
+    zeros = np.zeros(len(text), dtype=np.int64)
+    year = parts.get("Y", zeros + 1970)
+    month = parts.get("m", zeros + 1)
+    day = parts.get("d", zeros + 1)
+    hour, minute, sec = parts.get("H", zeros), parts.get("M", zeros), parts.get("S", zeros)
+
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (hour <= 23) & (minute <= 59) & (sec <= 59)
+    month = np.where(ok, month, 1)
+    day = np.where(ok, day, 1)
+    year = np.where(ok, year, 1970)
+
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + (day - 1)
+    ok &= days.astype("datetime64[M]") == months  # ex.: 31/02 cai no mês seguinte
+
+    stamps = days.astype("datetime64[s]") + (hour * 3600 + minute * 60 + sec)
+    return pd.Series(stamps.astype("datetime64[us]"), index=values.index).where(ok)
+
+def parse_kiper_timestamps(values: pd.Series) -> tuple[pd.Series, int]:
+    """
+    Converte uma coluna de datas do Kiper: detecta o formato uma vez pela
+    amostra e parseia tudo com formato fixo (caminho numpy para largura fixa).
+    Linhas que falharem tentam strptime com o mesmo formato e, por último, a
+    inferência (dayfirst). Retorna (datas, quantas viraram NaT sem estar vazias).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, 0
+
+    present = values.notna()
+    fmt = detect_timestamp_format(values[present])
+
+    if fmt is None:
+        parsed = pd.to_datetime(values, dayfirst=True, errors="coerce")
+    else:
+        parsed = _parse_fixed_width(values, fmt)
+        if parsed is None:
+            parsed = pd.to_datetime(values, format=fmt, errors="coerce")
+        else:
+            retry = present & parsed.isna()
+            if retry.any():
+                parsed = parsed.where(~retry, pd.to_datetime(values[retry], format=fmt, errors="coerce"))
+
+        retry = present & parsed.isna()
+        if retry.any():
+            fallback = pd.to_datetime(values[retry], dayfirst=True, errors="coerce")
+            parsed = parsed.where(~retry, fallback)
+
+    coerced = int((present & parsed.isna()).sum())
+    return parsed, coerced
 
 def normalize_kiper_csv(df: pd.DataFrame, source_file: str) -> pd.DataFrame:
     missing = [c for c in CSV_COLUMNS if c not in df.columns]
@@ -45,21 +317,21 @@ def normalize_kiper_csv(df: pd.DataFrame, source_file: str) -> pd.DataFrame:
 
     out = pd.DataFrame()
 
-    # Datas
-    out["event_timestamp"] = pd.to_datetime(df["Data do evento"], dayfirst=True, errors="coerce")
-    out["treatment_finished_at"] = pd.to_datetime(df["Data da finalização do tratamento"], dayfirst=True, errors="coerce")
+    # Datas (formato detectado uma vez; NaT = data ilegível)
+    out["event_timestamp"], bad_event_ts = parse_kiper_timestamps(df["Data do evento"])
+    out["treatment_finished_at"], bad_finished_at = parse_kiper_timestamps(df["Data da finalização do tratamento"])
 
     # Código numérico (pode vir como texto)
     out["event_type_code"] = pd.to_numeric(df["Tipo do evento"], errors="coerce").astype("Int64")
 
-    # Textos
-    out["event_description"] = df["Descrição do evento"].astype("string")
-    out["access_name"] = df["Nome do accesso"].astype("string")
+    # Textos (baixa cardinalidade -> categoria: guarda cada valor distinto uma vez)
+    out["event_description"] = df["Descrição do evento"].astype("string").astype("category")
+    out["access_name"] = df["Nome do accesso"].astype("string").astype("category")
     out["user_name"] = df["Nome do usuário"].astype("string")
-    out["user_profile"] = df["Perfil do usuário"].astype("string")
-    out["unit_group"] = df["Grupo de Unidade"].astype("string")
-    out["unit"] = df["Unidade"].astype("string")
-    out["handler_profile"] = df["Perfil do atendente"].astype("string")
+    out["user_profile"] = df["Perfil do usuário"].astype("string").astype("category")
+    out["unit_group"] = df["Grupo de Unidade"].astype("string").astype("category")
+    out["unit"] = df["Unidade"].astype("string").astype("category")
+    out["handler_profile"] = df["Perfil do atendente"].astype("string").astype("category")
     out["handler_name"] = df["Nome do atendente"].astype("string")
     out["treatment"] = df["Tratamento"].astype("string")
 
@@ -67,68 +339,417 @@ def normalize_kiper_csv(df: pd.DataFrame, source_file: str) -> pd.DataFrame:
     out = out.dropna(subset=["event_timestamp"]).copy()
 
     # event_id (dedup)
-    key_cols = ["event_timestamp", "access_name", "event_description", "user_name", "unit", "event_type_code"]
-    def make_key(row):
-        parts = []
-        for c in key_cols:
-            v = row[c]
-            parts.append("" if pd.isna(v) else str(v))
-        return _sha1("|".join(parts))
+    out["event_id"] = build_event_ids(out)
 
-    out["event_id"] = out.apply(make_key, axis=1)
+    # metadados (um único valor: categoria com 1 código por linha)
+    out["source_file"] = pd.Categorical.from_codes(
+        np.zeros(len(out), dtype="int8"), categories=[source_file]
+    )
 
-    # metadados
-    out["source_file"] = source_file
+    # ordem das colunas para INSERT
+    out = out[EVENT_COLUMNS]
 
-    # NA -> None
-    out = out.where(pd.notnull(out), None)
+    # quantas datas preenchidas não deu para ler (linhas sem event_timestamp são descartadas)
+    out.attrs["coerced_dates"] = {
+        "event_timestamp": bad_event_ts,
+        "treatment_finished_at": bad_finished_at,
+    }
+    return out
 
-    # ordem das colunas para INSERT
-    out = out[[
-        "event_id",
-        "event_timestamp",
-        "treatment_finished_at",
-        "event_type_code",
-        "event_description",
-        "access_name",
-        "user_name",
-        "user_profile",
-        "unit_group",
-        "unit",
-        "handler_profile",
-        "handler_name",
-        "treatment",
-        "source_file",
-    ]]
+def _iter_event_rows(df_events: pd.DataFrame):
+    """
+    Gera as tuplas para o INSERT coluna a coluna (NA/NaN/NaT -> None),
+    sem copiar o DataFrame inteiro para object nem materializar a lista toda.
+    """
+    cols = []
+    for c in df_events.columns:
+        col = df_events[c]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # objetos só das categorias, expandidos pelos códigos (-1 -> None)
+            cats = col.cat.categories.astype(object).tolist() + [None]
+            cols.append(np.asarray(cats, dtype=object)[col.cat.codes.to_numpy()].tolist())
+            continue
+        col = col.astype(object)
+        cols.append(col.where(col.notna(), None).tolist())
+    return zip(*cols)
+
+def concat_events(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    pd.concat de lotes normalizados mantendo as colunas categóricas
+    (concat simples vira object quando as categorias diferem entre arquivos).
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
 
+    out = pd.concat(frames, ignore_index=True)
+    for c in EVENT_COLUMNS:
+        if all(isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames):
+            out[c] = union_categoricals([f[c] for f in frames])
     return out
 
+def record_load(cur, inserted: int) -> None:
+    """
+    Registra a carga em public.events_loads, na transação do insert: o
+    count(*) dessa tabela é a versão dos dados que invalida os totais em
+    cache (src/totals.py). Carga sem linha nova não muda nada.
+    """
+    if inserted:
+        cur.execute("insert into public.events_loads (inserted) values (%s)", (inserted,))
+
+def _insert_events_values(cur, df_events: pd.DataFrame) -> int:
+    """
+    INSERT ... VALUES em páginas (execute_values). Retorna quantas linhas
+    realmente entraram (RETURNING), sem contar as barradas no ON CONFLICT.
+    Chamar com a conexão em transação (autocommit desligado): senão cada
+    página é gravada sozinha e uma falha no meio deixa eventos sem janela marcada.
+    """
+    sql = f"""
+    INSERT INTO public.events ({", ".join(EVENT_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (event_id) DO NOTHING
+    RETURNING access_name, event_timestamp;
+    """
+    inserted = execute_values(cur, sql, _iter_event_rows(df_events), page_size=2000, fetch=True)
+
+    # janelas (porta, min, max) do que entrou, para o refresh incremental das passagens
+    windows = {}
+    for r in inserted:
+        door, ts = r["access_name"], r["event_timestamp"]
+        if door is None or ts is None:
+            continue
+        lo, hi = windows.get(door, (ts, ts))
+        windows[door] = (min(lo, ts), max(hi, ts))
+    mark_dirty(cur, [(door, lo, hi) for door, (lo, hi) in windows.items()])
+    record_load(cur, len(inserted))
+    return len(inserted)
+
 def insert_events(df_events: pd.DataFrame) -> int:
+    """
+    INSERT ... VALUES (execute_values). Retorna quantas linhas realmente
+    entraram (as barradas no ON CONFLICT não contam).
+
+    Uma transação só: as páginas do execute_values e as janelas marcadas para
+    o refresh das passagens (mark_dirty) entram juntas ou nada entra.
+    """
     if df_events.empty:
         return 0
 
-    # 1) Garantia absoluta: tudo que for NA/NaN vira None
-    df_clean = df_events.copy()
+    with connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                inserted = _insert_events_values(cur, df_events)
+            conn.commit()
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+    return inserted
+
+# Linhas por COPY: limita o tamanho do buffer CSV em memória
+COPY_BATCH_ROWS = 200_000
+
+# Erros que querem dizer "COPY / tabela temporária não dá nesse banco" (ex.:
+# usuário sem TEMP, pooler que não suporta COPY): só esses caem no execute_values
+COPY_UNAVAILABLE_ERRORS = (
+    psycopg2.errors.InsufficientPrivilege,
+    psycopg2.errors.FeatureNotSupported,
+)
 
-    # Converte pd.NA/NaN para None (robusto)
-    df_clean = df_clean.astype(object).where(pd.notnull(df_clean), None)
+def _copy_events(cur, df_events: pd.DataFrame) -> int:
+    """
+    COPY para uma tabela temporária (some no commit) + um único INSERT com
+    anti-join em public.events. Retorna quantas linhas entraram.
+    """
+    cols = ", ".join(EVENT_COLUMNS)
 
-    # 2) Monta rows já limpos (list of tuples)
-    rows = [tuple(x) for x in df_clean.to_numpy()]
+    # Mesmos tipos de public.events, sem índices/constraints (carga rápida)
+    cur.execute(f"""
+    create temp table _events_stage on commit drop as
+    select {cols} from public.events with no data;
+    """)
 
-    sql = """
-    INSERT INTO public.events (
-        event_id, event_timestamp, treatment_finished_at, event_type_code,
-        event_description, access_name, user_name, user_profile,
-        unit_group, unit, handler_profile, handler_name, treatment, source_file
+    copy_sql = f"copy _events_stage ({cols}) from stdin with (format csv, null '\\N')"
+    for start in range(0, len(df_events), COPY_BATCH_ROWS):
+        buf = io.StringIO()
+        df_events.iloc[start:start + COPY_BATCH_ROWS].to_csv(
+            buf, header=False, index=False, na_rep="\\N", date_format="%Y-%m-%d %H:%M:%S.%f"
+        )
+        buf.seek(0)
+        cur.copy_expert(copy_sql, buf)
+
+    # distinct on: o mesmo event_id pode vir repetido dentro do próprio lote.
+    # Na mesma transação, marca (porta, min, max) do que entrou para o refresh
+    # incremental das passagens (src/passages.py) e registra a carga em
+    # events_loads (versão dos dados, ver record_load).
+    cur.execute(f"""
+    with ins as (
+        insert into public.events ({cols})
+        select distinct on (s.event_id) {", ".join("s." + c for c in EVENT_COLUMNS)}
+        from _events_stage s
+        where not exists (
+            select 1 from public.events e where e.event_id = s.event_id
+        )
+        order by s.event_id
+        on conflict (event_id) do nothing
+        returning access_name, event_timestamp
+    ),
+    dirty as (
+        insert into public.passages_v5_dirty (access_name, min_ts, max_ts)
+        select access_name, min(event_timestamp), max(event_timestamp)
+        from ins
+        where access_name is not null
+          and event_timestamp is not null
+        group by access_name
+    ),
+    loaded as (
+        insert into public.events_loads (inserted)
+        select count(*) from ins
+        having count(*) > 0
     )
-    VALUES %s
-    ON CONFLICT (event_id) DO NOTHING;
+    select count(*) as inserted from ins;
+    """)
+    return cur.fetchone()["inserted"]
+
+def insert_events_bulk(df_events: pd.DataFrame) -> tuple[int, int]:
+    """
+    Carga rápida para lotes grandes (backfill): COPY + merge em uma transação.
+    Se o COPY não for possível (ex.: sem permissão para tabela temporária,
+    COPY_UNAVAILABLE_ERRORS), cai no caminho antigo com execute_values e
+    registra o motivo no log. Qualquer outro erro sobe.
+
+    Retorna (inseridos, duplicados) de verdade — duplicados = linhas do lote
+    que já existiam no banco (ou repetidas no próprio lote).
+    """
+    if df_events.empty:
+        return 0, 0
+
+    with connection() as conn:
+        conn.autocommit = False  # staging "on commit drop" precisa de transação
+        try:
+            try:
+                with conn.cursor() as cur:
+                    inserted = _copy_events(cur, df_events)
+                conn.commit()
+            except COPY_UNAVAILABLE_ERRORS as e:
+                # só "COPY/tabela temporária não permitidos aqui"; erro de dado,
+                # de encoding ou de conexão sobe como está
+                conn.rollback()
+                logger.warning("COPY indisponível (%s: %s); usando execute_values.", type(e).__name__, e)
+                with conn.cursor() as cur:
+                    inserted = _insert_events_values(cur, df_events)
+                conn.commit()
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+    return inserted, len(df_events) - inserted
+
+def ingest_kiper_csv_streaming(uploaded_file, source_file: str, chunksize: int = DEFAULT_CHUNKSIZE, on_chunk=None,
+                               use_manifest: bool = True, skip_covered: bool = False) -> tuple[int, int]:
+    """
+    Modo streaming: lê `chunksize` linhas, normaliza, insere e só então lê
+    o próximo pedaço. O pico de memória fica perto de um chunk, seja qual for
+    o tamanho do arquivo.
+
+    Com use_manifest: arquivo idêntico a um já carregado é pulado sem ler e,
+    no fim, o arquivo (com a cobertura por porta) entra no manifest.
+    Com skip_covered (opcional, exige use_manifest): linhas de portas/horários
+    já cobertos por arquivos anteriores nem vão ao banco (contam como
+    duplicadas). Só vale se os arquivos anteriores eram exports completos: se
+    um deles era parcial/filtrado, os eventos que faltavam nele e vêm neste
+    arquivo se perdem.
+
+    on_chunk(chunk_idx, rows_read, inserted, duplicates, bytes_read) é chamado
+    depois de cada carga (ex.: para atualizar a barra de progresso no Admin).
+    Retorna (inseridos, duplicados) somados de todos os pedaços.
     """
+    rows_read = 0
+    inserted = 0
+    duplicates = 0
+
+    content_hash, covered, coverage = None, None, []
+    if use_manifest:
+        content_hash = file_content_hash(uploaded_file)
+        entry = get_manifest_entry(content_hash)
+        if entry is not None:
+            raise FileAlreadyIngested(source_file, entry)
+        if skip_covered:
+            covered = fetch_covered_ranges()
+
+    for i, chunk in enumerate(iter_kiper_csv_chunks(uploaded_file, chunksize=chunksize), start=1):
+        rows_read += len(chunk)
+        df_events = normalize_kiper_csv(chunk, source_file=source_file)
+        del chunk
+
+        if use_manifest:
+            coverage.append(door_coverage(df_events))
+        if covered is not None:
+            skip = covered_mask(df_events, covered)
+            duplicates += int(skip.sum())
+            df_events = df_events[~skip]
+
+        ins, dup = insert_events_bulk(df_events)
+        inserted += ins
+        duplicates += dup
+        del df_events
+
+        if on_chunk is not None:
+            try:
+                bytes_read = uploaded_file.tell()
+            except Exception:
+                bytes_read = None
+            on_chunk(i, rows_read, inserted, duplicates, bytes_read)
+
+    if use_manifest:
+        record_manifest(content_hash, source_file, rows_read, combine_coverage(coverage))
+
+    return inserted, duplicates
+
+def default_ingest_workers() -> int:
+    """Workers padrão do modo paralelo: um por núcleo, até 4."""
+    return max(1, min(4, os.cpu_count() or 1))
+
+def _read_and_normalize_file(name: str, data) -> tuple[pd.DataFrame, int, float]:
+    """
+    Roda no processo worker: lê + normaliza um arquivo (sem tocar no banco).
+    data: bytes do arquivo ou caminho no disco (o worker abre sozinho).
+    """
+    t0 = time.perf_counter()
+    if isinstance(data, bytes):
+        df_raw = read_kiper_csv(io.BytesIO(data))
+    else:
+        with open(data, "rb") as f:
+            df_raw = read_kiper_csv(f)
+    rows_raw = len(df_raw)
+    df_events = normalize_kiper_csv(df_raw, source_file=name)
+    return df_events, rows_raw, time.perf_counter() - t0
+
+def ingest_kiper_files_parallel(files, max_workers: int | None = None, on_file=None,
+                                use_manifest: bool = True, skip_covered: bool = False) -> tuple[int, int]:
+    """
+    Lê e normaliza vários CSVs em paralelo (ProcessPool) e grava cada lote no
+    banco assim que fica pronto — sem pd.concat de todos os arquivos.
+
+    files: lista de (nome, bytes), caminhos no disco (str/Path) ou objetos com
+    .name/.getvalue() (UploadedFile). Caminhos são lidos pelos próprios workers.
+    No máximo `max_workers` arquivos ficam em processamento ao mesmo tempo, o
+    que limita a memória a alguns lotes normalizados.
+
+    Com use_manifest, arquivos já carregados (mesmo sha256) são pulados antes
+    de ir para o pool. Com skip_covered (opcional, exige use_manifest), linhas
+    já cobertas por porta/horário em arquivos anteriores não vão ao banco
+    (ver ingest_kiper_csv_streaming: perde eventos se um arquivo anterior era
+    parcial).
+
+    on_file(info) é chamado quando cada arquivo termina, com o dict:
+    file, rows_raw, events, bad_dates, inserted, duplicates, covered (das
+    duplicadas, quantas o skip_covered tirou sem ir ao banco), parse_s,
+    load_s, skipped, error (erro do próprio arquivo: CSV inválido, dado rejeitado).
+    Retorna (inseridos, duplicados) somados.
+
+    Erro de conexão com o banco (psycopg2.OperationalError/InterfaceError)
+    interrompe tudo e é relançado: o arquivo em que aconteceu e os que faltam
+    não passam pelo on_file (os anteriores já foram gravados).
+    """
+    max_workers = max_workers or default_ingest_workers()
+    pending_files = list(files)[::-1]  # pop() do fim mantém a ordem original
+    covered = fetch_covered_ranges() if use_manifest and skip_covered else None
+    seen_hashes = set()
+
+    inserted = 0
+    duplicates = 0
+
+    def new_info(name):
+        return {
+            "file": name, "rows_raw": 0, "events": 0, "inserted": 0, "duplicates": 0, "covered": 0,
+            "bad_dates": 0, "parse_s": None, "load_s": None, "skipped": None, "error": None,
+        }
+
+    # spawn: não faz fork do processo do Streamlit (cheio de threads)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+        running = {}
+
+        def submit_next():
+            while pending_files:
+                f = pending_files.pop()
+                if isinstance(f, tuple):
+                    name, data = f
+                elif isinstance(f, (str, os.PathLike)):
+                    name, data = os.path.basename(f), os.fspath(f)
+                else:
+                    name, data = f.name, f.getvalue()
+
+                content_hash = None
+                if use_manifest:
+                    if isinstance(data, bytes):
+                        content_hash = bytes_content_hash(data)
+                    else:
+                        with open(data, "rb") as fh:
+                            content_hash = file_content_hash(fh)
+                    entry = get_manifest_entry(content_hash)
+                    if entry is not None or content_hash in seen_hashes:
+                        info = new_info(name)
+                        info["skipped"] = (
+                            str(FileAlreadyIngested(name, entry)) if entry is not None
+                            else f"{name}: conteúdo repetido neste mesmo envio."
+                        )
+                        if on_file is not None:
+                            on_file(info)
+                        continue
+                    seen_hashes.add(content_hash)
+
+                running[pool.submit(_read_and_normalize_file, name, data)] = (name, content_hash)
+                return
+
+        while pending_files and len(running) < max_workers:
+            submit_next()
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, content_hash = running.pop(fut)
+                submit_next()
+
+                info = new_info(name)
+                try:
+                    df_events, info["rows_raw"], info["parse_s"] = fut.result()
+                    info["events"] = len(df_events)
+                    info["bad_dates"] = df_events.attrs.get("coerced_dates", {}).get("event_timestamp", 0)
+
+                    t0 = time.perf_counter()
+                    if use_manifest:
+                        coverage = door_coverage(df_events)
+                    if covered is not None:
+                        skip = covered_mask(df_events, covered)
+                        df_events = df_events[~skip]
+                        info["covered"] = int(skip.sum())
+                        info["duplicates"] += info["covered"]
+
+                    ins, dup = insert_events_bulk(df_events)
+                    info["inserted"] = ins
+                    info["duplicates"] += dup
+
+                    if use_manifest:
+                        record_manifest(content_hash, name, info["rows_raw"], coverage)
+                    info["load_s"] = time.perf_counter() - t0
+                    del df_events
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    # banco fora / conexão caiu: não é problema do arquivo, os
+                    # próximos falhariam igual. Sobe para quem chamou, sem on_file.
+                    raise
+                except Exception as e:
+                    info["error"] = str(e)
 
-    conn = get_conn()
-    with conn.cursor() as cur:
-        execute_values(cur, sql, rows, page_size=2000)
+                inserted += info["inserted"]
+                duplicates += info["duplicates"]
+                if on_file is not None:
+                    on_file(info)
 
-    conn.commit()
-    return len(rows)
\ No newline at end of file
+    return inserted, duplicates
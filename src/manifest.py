@@ -0,0 +1,168 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from src.db import connection, fetch_df
+
+# Tabelas: ver sql_query/generate public-ingest_manifest
+
+def file_content_hash(uploaded_file) -> str:
+    """sha256 do conteúdo do arquivo (lido em blocos). Devolve o stream no início."""
+    h = hashlib.sha256()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(1024 * 1024), b""):
+        h.update(block)
+    uploaded_file.seek(0)
+    return h.hexdigest()
+
+def bytes_content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def get_manifest_entry(content_hash: str) -> dict | None:
+    """Registro do manifest para esse conteúdo (ou None se nunca foi carregado)."""
+    rows = fetch_df(
+        """
+        select content_hash, source_file, row_count, event_count, min_ts, max_ts, ingested_at
+        from public.ingest_manifest
+        where content_hash = %(h)s;
+        """,
+        {"h": content_hash},
+    )
+    return rows[0] if rows else None
+
+def fetch_covered_ranges() -> pd.DataFrame:
+    """
+    Intervalos [min_ts, max_ts] já carregados por porta (access_name),
+    com intervalos sobrepostos da mesma porta já unidos. Intervalos que só se
+    encostam (um termina no segundo em que o outro começa) ficam separados:
+    esse segundo é borda dos dois e não conta como coberto (ver covered_mask).
+    """
+    rows = fetch_df(
+        """
+        select access_name, min_ts, max_ts
+        from public.ingest_manifest_doors
+        order by access_name, min_ts;
+        """
+    )
+    if not rows:
+        return pd.DataFrame(columns=["access_name", "min_ts", "max_ts"])
+
+    merged = []
+    for r in rows:
+        last = merged[-1] if merged else None
+        if last and last["access_name"] == r["access_name"] and r["min_ts"] < last["max_ts"]:
+            last["max_ts"] = max(last["max_ts"], r["max_ts"])
+        else:
+            merged.append(dict(r))
+    return pd.DataFrame(merged)
+
+def covered_mask(df_events: pd.DataFrame, covered: pd.DataFrame) -> pd.Series:
+    """
+    True para eventos cujo (porta, horário) já cai dentro de um intervalo
+    carregado antes. Busca binária por porta (intervalos já unidos e ordenados).
+    Eventos sem access_name nunca contam como cobertos.
+
+    Só é usado com skip_covered (desligado por padrão): supõe que os arquivos
+    anteriores tinham todos os eventos do período deles. Se um era parcial ou
+    filtrado, o que faltava nele e vem num export completo depois é descartado.
+
+    As bordas são exclusivas: um arquivo que terminou às 10:00:00 pode não ter
+    todos os eventos desse segundo, e um export novo que começa às 10:00:00 pode
+    trazer outros. Eventos exatamente em min_ts/max_ts vão ao banco e o
+    ON CONFLICT (event_id) descarta os que já existem.
+    """
+    mask = pd.Series(False, index=df_events.index)
+    if df_events.empty or covered is None or covered.empty:
+        return mask
+
+    ts_all = pd.to_datetime(df_events["event_timestamp"])
+    for door, iv in covered.groupby("access_name", sort=False):
+        in_door = (df_events["access_name"] == door).fillna(False).to_numpy(dtype=bool)
+        if not in_door.any():
+            continue
+        starts = pd.to_datetime(iv["min_ts"]).to_numpy(dtype="datetime64[us]")
+        ends = pd.to_datetime(iv["max_ts"]).to_numpy(dtype="datetime64[us]")
+        ts = ts_all[in_door].to_numpy(dtype="datetime64[us]")
+
+        # último intervalo que começa antes (estritamente) do evento
+        idx = np.searchsorted(starts, ts, side="left") - 1
+        hit = idx >= 0
+        hit[hit] = ts[hit] < ends[idx[hit]]
+        mask.iloc[np.flatnonzero(in_door)] = hit
+    return mask
+
+def door_coverage(df_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    min/max/contagem de eventos por porta de um lote (somável entre pedaços).
+    Eventos sem porta ficam numa linha com access_name nulo: entram nos totais
+    do manifest, mas não viram cobertura.
+    """
+    if df_events.empty:
+        return pd.DataFrame(columns=["access_name", "min_ts", "max_ts", "event_count"])
+    return (
+        df_events.groupby("access_name", observed=True, dropna=False)["event_timestamp"]
+        .agg(min_ts="min", max_ts="max", event_count="count")
+        .reset_index()
+    )
+
+def combine_coverage(parts: list[pd.DataFrame]) -> pd.DataFrame:
+    """Junta coberturas de vários pedaços do mesmo arquivo."""
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=["access_name", "min_ts", "max_ts", "event_count"])
+    return (
+        pd.concat(parts, ignore_index=True)
+        .groupby("access_name", observed=True, dropna=False)
+        .agg(min_ts=("min_ts", "min"), max_ts=("max_ts", "max"), event_count=("event_count", "sum"))
+        .reset_index()
+    )
+
+def record_manifest(content_hash: str, source_file: str, row_count: int, coverage: pd.DataFrame) -> None:
+    """
+    Grava o arquivo (e a cobertura por porta) no manifest, numa transação só
+    (nunca fica registro de arquivo sem as portas). Idempotente por content_hash.
+    """
+    event_count = int(coverage["event_count"].sum()) if not coverage.empty else 0
+    min_ts = coverage["min_ts"].min() if not coverage.empty else None
+    max_ts = coverage["max_ts"].max() if not coverage.empty else None
+
+    with connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    insert into public.ingest_manifest
+                        (content_hash, source_file, row_count, event_count, min_ts, max_ts)
+                    values (%(h)s, %(f)s, %(rows)s, %(events)s, %(min_ts)s, %(max_ts)s)
+                    on conflict (content_hash) do nothing;
+                    """,
+                    {
+                        "h": content_hash,
+                        "f": source_file,
+                        "rows": int(row_count),
+                        "events": event_count,
+                        "min_ts": None if pd.isna(min_ts) else min_ts.to_pydatetime(),
+                        "max_ts": None if pd.isna(max_ts) else max_ts.to_pydatetime(),
+                    },
+                )
+                doors = coverage[coverage["access_name"].notna()]
+                if cur.rowcount and not doors.empty:
+                    execute_values(
+                        cur,
+                        """
+                        insert into public.ingest_manifest_doors
+                            (content_hash, access_name, min_ts, max_ts, event_count)
+                        values %s
+                        on conflict do nothing;
+                        """,
+                        [
+                            (content_hash, str(r.access_name), r.min_ts.to_pydatetime(), r.max_ts.to_pydatetime(), int(r.event_count))
+                            for r in doors.itertuples(index=False)
+                        ],
+                    )
+            conn.commit()
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
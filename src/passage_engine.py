@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+from src.db import fetch_frame
+from src.passages import CLOSE_WINDOW_S, CAUSE_WINDOW_S
+
+# Mesma lógica de vw_passages_v5 / vw_passage_classification_v5 (sql_query/ é a
+# referência), em NumPy sobre eventos em memória: para análise offline,
+# backfills e testar outras janelas sem mexer nas views.
+# Paridade com o SQL: tools/check_passage_engine.py
+
+OPEN_CODE = 165
+CLOSE_CODE = 167
+CAUSE_CODES = (177, 701, 708, 311)
+FLAG_CODES = {
+    "has_held_open": (166,),
+    "has_failed_close": (112, 113, 114),
+    "has_door_alert": (411,),
+}
+PASSAGE_KIND = {
+    701: "entrada_facial",
+    708: "entrada_convidado_facial",
+    177: "saida_botoeira",
+    311: "comando_app",
+}
+# coluna do evento causa -> coluna na classificação
+CAUSE_COLUMNS = {
+    "event_description": "cause_desc",
+    "user_name": "user_name",
+    "user_profile": "user_profile",
+    "unit": "unit",
+    "unit_group": "unit_group",
+    "handler_name": "handler_name",
+    "handler_profile": "handler_profile",
+}
+EVENT_COLUMNS = ("event_id", "event_timestamp", "event_type_code", "access_name", *CAUSE_COLUMNS)
+
+# Horários em microssegundos (resolução do timestamp do PostgreSQL)
+_US = 1_000_000
+# Folga entre portas na chave: nenhuma janela pode passar disso
+_DOOR_GAP_US = 86_400 * _US
+
+class EventStore:
+    """
+    Eventos em arrays NumPy, ordenados por (porta, horário, event_id).
+
+    Cada evento vira uma chave int64 = porta * passo + (horário - t0) em µs, com
+    um dia de folga entre portas: uma busca [chave, chave + janela] nunca cai
+    em outra porta, então um searchsorted no array todo já é "mesma porta".
+    Eventos sem porta ficam de fora (não viram passagem nem causa).
+    """
+
+    def __init__(self, events: pd.DataFrame):
+        events = events[events["access_name"].notna()]
+
+        door, self.doors = pd.factorize(events["access_name"], sort=True)
+        ts = events["event_timestamp"].to_numpy("datetime64[us]").view(np.int64)
+        self.t0 = int(ts.min()) if len(ts) else 0
+        rel = ts - self.t0
+        self.stride = (int(rel.max()) if len(rel) else 0) + _DOOR_GAP_US
+        if len(self.doors) and len(self.doors) * self.stride >= np.iinfo(np.int64).max:
+            raise ValueError("Período longo demais para o número de portas (chave int64 estoura).")
+
+        key = door.astype(np.int64) * self.stride + rel
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+
+        # Empates (mesma porta e horário): só esses blocos são reordenados por
+        # event_id, em bytes = mesma ordem do collate "C" (menor event_id primeiro).
+        # Ordenar tudo por string custaria ~10x mais.
+        event_id = events["event_id"].to_numpy(dtype=object)
+        dup = np.flatnonzero(key[1:] == key[:-1])
+        if len(dup):
+            tied = np.unique(np.concatenate([dup, dup + 1]))
+            sub = order[tied]
+            order[tied] = sub[np.lexsort((event_id[sub].astype("S"), key[tied]))]
+
+        self.key = key
+        self.door = door[order]
+        self.ts = ts[order]
+        self.code = events["event_type_code"].fillna(-1).to_numpy(np.int64)[order]
+        self.event_id = event_id[order]
+        self.columns = {c: events[c].to_numpy(dtype=object)[order] for c in CAUSE_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.key)
+
+    @classmethod
+    def from_frame(cls, events: pd.DataFrame) -> "EventStore":
+        """DataFrame com as colunas de EVENT_COLUMNS (ex.: fetch_frame em public.events)."""
+        missing = [c for c in EVENT_COLUMNS if c not in events.columns]
+        if missing:
+            raise ValueError(f"Faltam colunas nos eventos: {', '.join(missing)}")
+        return cls(events)
+
+    def keys_of(self, codes) -> np.ndarray:
+        """Chaves (ordenadas) dos eventos com esses códigos."""
+        return self.key[np.isin(self.code, codes)]
+
+    def positions_of(self, codes) -> np.ndarray:
+        return np.flatnonzero(np.isin(self.code, codes))
+
+    def door_keys(self, doors, ts) -> np.ndarray:
+        """Chave de (porta, horário) vindos de fora (ex.: passagens já calculadas)."""
+        door = self.doors.get_indexer(doors)
+        if (door < 0).any():
+            raise ValueError("Passagem de porta que não está nos eventos.")
+        rel = pd.to_datetime(ts).to_numpy("datetime64[us]").view(np.int64) - self.t0
+        return door.astype(np.int64) * self.stride + rel
+
+def load_event_store(start=None, end=None) -> EventStore:
+    """
+    Lê public.events (opcionalmente só [start, end]) para um EventStore.
+    Passagens a menos de 90 s / 30 s das bordas do período podem sair
+    diferentes da view (fechamento/causa ficaram fora do que foi lido).
+    """
+    where, params = [], {}
+    if start is not None:
+        where.append("event_timestamp >= %(start)s")
+        params["start"] = start
+    if end is not None:
+        where.append("event_timestamp <= %(end)s")
+        params["end"] = end
+    sql = f"""
+    select {", ".join(EVENT_COLUMNS)}
+    from public.events
+    {"where " + " and ".join(where) if where else ""}
+    """
+    return EventStore.from_frame(fetch_frame(sql, params))
+
+def _check_window(seconds: int) -> int:
+    us = int(seconds * _US)
+    if not 0 <= us < _DOOR_GAP_US:
+        raise ValueError(f"Janela fora do suportado (0 a 1 dia): {seconds}s")
+    return us
+
+def _first_at_or_after(keys: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Índice do primeiro keys[i] em [lo, hi] (o de menor event_id, no empate), ou -1."""
+    i = np.searchsorted(keys, lo, side="left")
+    found = i < len(keys)
+    found[found] &= keys[i[found]] <= hi[found]
+    return np.where(found, i, -1)
+
+def _last_at_or_before(keys: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Índice do último horário em [lo, hi] (no empate, o de menor event_id), ou -1."""
+    if not len(keys):
+        return np.full(len(hi), -1)
+    j = np.searchsorted(keys, hi, side="right") - 1
+    found = j >= 0
+    found[found] &= keys[j[found]] >= lo[found]
+    # volta para o primeiro do bloco de chaves iguais
+    first = np.searchsorted(keys, keys[np.maximum(j, 0)], side="left")
+    return np.where(found, first, -1)
+
+def _any_in(keys: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Existe keys[i] em [lo, hi]?"""
+    return np.searchsorted(keys, hi, side="right") > np.searchsorted(keys, lo, side="left")
+
+def _positions(pos: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """pos[idx] (índice num subconjunto -> posição no store), -1 onde idx == -1."""
+    if not len(pos):
+        return np.full(len(idx), -1)
+    return np.where(idx >= 0, pos[np.maximum(idx, 0)], -1)
+
+def _take(values: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """values[idx], com None onde idx == -1."""
+    out = np.full(len(idx), None, dtype=object)
+    hit = idx >= 0
+    out[hit] = values[idx[hit]]
+    return out
+
+def _timestamps(us: np.ndarray, valid=None) -> pd.Series:
+    ts = pd.Series(us.astype("datetime64[us]"))
+    return ts if valid is None else ts.where(valid)
+
+def _seconds(delta_us: np.ndarray) -> np.ndarray:
+    """extract(epoch from intervalo)::int (arredonda, meio segundo para cima; intervalos >= 0)."""
+    return np.floor(delta_us / _US + 0.5).astype(np.int64)
+
+def pair_passages(store: EventStore, close_window_s: int = CLOSE_WINDOW_S) -> pd.DataFrame:
+    """
+    vw_passages_v5: cada abertura (165) com o primeiro fechamento (167) da mesma
+    porta em [abertura, abertura + close_window_s] (mesmo segundo conta; empate:
+    menor event_id). Mesmas colunas da view, na ordem (porta, horário, event_id).
+    """
+    window = _check_window(close_window_s)
+    opens = store.positions_of([OPEN_CODE])
+    close_pos = store.positions_of([CLOSE_CODE])
+    open_key = store.key[opens]
+
+    hit = _first_at_or_after(store.key[close_pos], open_key, open_key + window)
+    close = _positions(close_pos, hit)
+    closed = close >= 0
+    close_ts = np.where(closed, store.ts[np.maximum(close, 0)], 0)
+
+    seconds = pd.array(np.where(closed, _seconds(close_ts - store.ts[opens]), 0), dtype="Int64")
+    seconds[~closed] = pd.NA
+
+    return pd.DataFrame({
+        "open_event_id": store.event_id[opens],
+        "open_ts": _timestamps(store.ts[opens]),
+        "close_event_id": _take(store.event_id, close),
+        "close_ts": _timestamps(close_ts, closed),
+        "seconds_open": seconds,
+        "door_access_name": store.doors[store.door[opens]].to_numpy(dtype=object),
+    })
+
+def classify_passages(
+    store: EventStore,
+    passages: pd.DataFrame | None = None,
+    close_window_s: int = CLOSE_WINDOW_S,
+    cause_window_s: int = CAUSE_WINDOW_S,
+) -> pd.DataFrame:
+    """
+    vw_passage_classification_v5 sobre as passagens (default: pair_passages):
+    - causa = último 177/701/708/311 da porta em [abertura - cause_window_s,
+      abertura] (empate no mesmo segundo: menor event_id);
+    - flags = algum 166 / 112-114 / 411 em [abertura, fechamento] (sem
+      fechamento: abertura + close_window_s).
+    Mesmas colunas da view.
+    """
+    close_window = _check_window(close_window_s)
+    cause_window = _check_window(cause_window_s)
+    if passages is None:
+        passages = pair_passages(store, close_window_s)
+    passages = passages.reset_index(drop=True)
+
+    open_key = store.door_keys(passages["door_access_name"], passages["open_ts"])
+    close_ts = passages["close_ts"]
+    # fim da janela das flags: fechamento ou abertura + close_window
+    end_key = np.where(
+        close_ts.notna(),
+        open_key + (pd.to_datetime(close_ts) - pd.to_datetime(passages["open_ts"])).to_numpy("timedelta64[us]").view(np.int64),
+        open_key + close_window,
+    )
+
+    out = passages[["open_event_id", "open_ts", "close_ts", "seconds_open", "door_access_name"]].copy()
+
+    cause_pos = store.positions_of(CAUSE_CODES)
+    hit = _last_at_or_before(store.key[cause_pos], open_key - cause_window, open_key)
+    cause = _positions(cause_pos, hit)
+    has_cause = cause >= 0
+    cause_code = store.code[np.maximum(cause, 0)]
+    cause_ts = store.ts[np.maximum(cause, 0)]
+
+    out["cause_event_id"] = _take(store.event_id, cause)
+    out["cause_ts"] = _timestamps(cause_ts, has_cause)
+    codes = pd.array(cause_code, dtype="Int64")
+    codes[~has_cause] = pd.NA
+    out["cause_code"] = codes
+    for column, name in CAUSE_COLUMNS.items():
+        out[name] = _take(store.columns[column], cause)
+
+    for flag, flag_codes in FLAG_CODES.items():
+        out[flag] = _any_in(store.keys_of(flag_codes), open_key, end_key)
+
+    out["passage_kind"] = np.select(
+        [~has_cause] + [cause_code == c for c in PASSAGE_KIND],
+        ["sem_causa"] + list(PASSAGE_KIND.values()),
+        "outro",
+    ).astype(object)
+
+    open_us = pd.to_datetime(passages["open_ts"]).to_numpy("datetime64[us]").view(np.int64)
+    out["confianca_causa"] = np.select(
+        [~has_cause, open_us - cause_ts <= 5 * _US],
+        ["baixa", "alta"],
+        "media",
+    ).astype(object)
+    return out
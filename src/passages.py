@@ -0,0 +1,259 @@
+from psycopg2.extras import execute_values
+from src.db import connection
+
+# Tabelas: ver sql_query/generate public-passages_v5_tables
+#
+# Um evento novo na porta em t só muda passagens com abertura em
+# [t - CLOSE_WINDOW, t + CAUSE_WINDOW]:
+# - 167 fecha aberturas de até 90 s antes; 166/112-114/411 caem na janela
+#   [abertura, fechamento] de aberturas de até 90 s antes;
+# - 177/701/708/311 são causa de aberturas de até 30 s depois;
+# - 165 é a própria abertura.
+CLOSE_WINDOW_S = 90
+CAUSE_WINDOW_S = 30
+CLOSE_WINDOW = f"{CLOSE_WINDOW_S} seconds"
+CAUSE_WINDOW = f"{CAUSE_WINDOW_S} seconds"
+
+# Trava (advisory) do refresh: dois refreshes em paralelo regravariam as mesmas passagens
+REFRESH_LOCK_KEY = 165167
+
+def mark_dirty(cur, windows) -> None:
+    """
+    Marca (porta, min_ts, max_ts) com eventos novos, na transação do insert.
+    Portas/horários nulos não viram passagem e são ignorados.
+    """
+    rows = [(door, lo, hi) for door, lo, hi in windows if door is not None and lo is not None]
+    if rows:
+        execute_values(
+            cur,
+            "insert into public.passages_v5_dirty (access_name, min_ts, max_ts) values %s",
+            rows,
+        )
+
+# Junta os intervalos marcados (com a folga de 90 s antes / 30 s depois) por porta;
+# intervalos que se sobrepõem viram um só (range_agg).
+_TAKE_WINDOWS_SQL = f"""
+create temp table _passage_windows (
+  window_id int,
+  access_name text,
+  from_ts timestamp,
+  to_ts timestamp
+) on commit drop;
+
+with taken as (
+  delete from public.passages_v5_dirty
+  returning access_name, min_ts, max_ts
+),
+merged as (
+  select
+    t.access_name,
+    unnest(range_agg(tsrange(t.min_ts - interval '{CLOSE_WINDOW}', t.max_ts + interval '{CAUSE_WINDOW}', '[]'))) as r
+  from taken t
+  group by t.access_name
+)
+insert into _passage_windows (window_id, access_name, from_ts, to_ts)
+select row_number() over (), m.access_name, lower(m.r), upper(m.r)
+from merged m;
+
+analyze _passage_windows;
+"""
+
+# As janelas entram sempre por LATERAL (com offset 0 / window function, o
+# planner não achata a subconsulta): cada janela vira uma busca por faixa no
+# índice (porta, horário). Num join comum o planner não sabe que as janelas são
+# estreitas e lê a tabela inteira (seq scan + hash join) até num lote de um dia.
+_DELETE_SQL = """
+delete from public.passage_classification_v5 c
+where c.open_event_id in (
+  select x.open_event_id
+  from _passage_windows w
+  cross join lateral (
+    select q.open_event_id
+    from public.passage_classification_v5 q
+    where q.door_access_name = w.access_name
+      and q.open_ts between w.from_ts and w.to_ts
+    offset 0
+  ) x
+);
+
+delete from public.passages_v5 p
+where p.open_event_id in (
+  select x.open_event_id
+  from _passage_windows w
+  cross join lateral (
+    select q.open_event_id
+    from public.passages_v5 q
+    where q.door_access_name = w.access_name
+      and q.open_ts between w.from_ts and w.to_ts
+    offset 0
+  ) x
+);
+"""
+
+# Mesma lógica do vw_passages_v5, só com os eventos de cada janela
+# (+ 90 s depois do fim, onde ainda pode estar o fechamento da última abertura).
+_INSERT_PASSAGES_SQL = f"""
+insert into public.passages_v5
+  (open_event_id, open_ts, close_event_id, close_ts, seconds_open, door_access_name)
+select
+  o.event_id,
+  o.event_timestamp,
+  c.close_event_id,
+  c.close_ts,
+  case
+    when c.close_ts is not null then extract(epoch from (c.close_ts - o.event_timestamp))::int
+    else null
+  end,
+  o.access_name
+from _passage_windows w
+cross join lateral (
+  select
+    e.event_id,
+    e.event_timestamp,
+    e.event_type_code,
+    e.access_name,
+    min(e.event_timestamp) filter (where e.event_type_code = 167) over (
+      order by e.event_timestamp desc, (e.event_type_code = 167) desc
+      rows between unbounded preceding and current row
+    ) as next_close_ts
+  from public.events e
+  where e.access_name = w.access_name
+    and e.event_timestamp >= w.from_ts
+    and e.event_timestamp <= w.to_ts + interval '{CLOSE_WINDOW}'
+    and e.event_type_code in (165, 167)
+) o
+left join lateral (
+  select
+    e.event_timestamp as close_ts,
+    min(e.event_id) as close_event_id
+  from public.events e
+  where e.access_name = w.access_name
+    and e.event_timestamp = o.next_close_ts
+    and e.event_type_code = 167
+  group by e.event_timestamp
+) c on o.next_close_ts <= o.event_timestamp + interval '{CLOSE_WINDOW}'
+where o.event_type_code = 165
+  and o.event_timestamp between w.from_ts and w.to_ts;
+"""
+
+# Mesma lógica do vw_passage_classification_v5, para as passagens recém-gravadas das janelas
+_INSERT_CLASSIFICATION_SQL = f"""
+insert into public.passage_classification_v5
+  (open_event_id, open_ts, close_ts, seconds_open, door_access_name,
+   cause_event_id, cause_ts, cause_code, cause_desc,
+   user_name, user_profile, unit, unit_group, handler_name, handler_profile,
+   has_held_open, has_failed_close, has_door_alert, passage_kind, confianca_causa)
+select
+  p.open_event_id,
+  p.open_ts,
+  p.close_ts,
+  p.seconds_open,
+  p.door_access_name,
+  c.cause_event_id,
+  c.cause_ts,
+  c.cause_code,
+  c.cause_desc,
+  c.user_name,
+  c.user_profile,
+  c.unit,
+  c.unit_group,
+  c.handler_name,
+  c.handler_profile,
+  coalesce(r.has_held_open, false),
+  coalesce(r.has_failed_close, false),
+  coalesce(r.has_door_alert, false),
+  case
+    when c.cause_code = 701 then 'entrada_facial'
+    when c.cause_code = 708 then 'entrada_convidado_facial'
+    when c.cause_code = 177 then 'saida_botoeira'
+    when c.cause_code = 311 then 'comando_app'
+    when c.cause_code is null then 'sem_causa'
+    else 'outro'
+  end,
+  case
+    when c.cause_code is null then 'baixa'
+    when extract(epoch from (p.open_ts - c.cause_ts)) <= 5 then 'alta'
+    else 'media'
+  end
+from _passage_windows w
+cross join lateral (
+  select q.*
+  from public.passages_v5 q
+  where q.door_access_name = w.access_name
+    and q.open_ts between w.from_ts and w.to_ts
+  offset 0
+) p
+left join lateral (
+  select
+    e.*,
+    /* evento sem código não é causa (null ordenaria antes de true no "desc") */
+    coalesce(e.event_type_code in (177,701,708,311), false) and e.event_timestamp <= p.open_ts as is_cause,
+    bool_or(e.event_timestamp >= p.open_ts and e.event_type_code = 166) over () as has_held_open,
+    bool_or(e.event_timestamp >= p.open_ts and e.event_type_code in (112,113,114)) over () as has_failed_close,
+    bool_or(e.event_timestamp >= p.open_ts and e.event_type_code = 411) over () as has_door_alert
+  from public.events e
+  where e.access_name = p.door_access_name
+    and e.event_timestamp >= p.open_ts - interval '{CAUSE_WINDOW}'
+    and e.event_timestamp <= coalesce(p.close_ts, p.open_ts + interval '{CLOSE_WINDOW}')
+  order by is_cause desc, e.event_timestamp desc, e.event_id
+  limit 1
+) r on true
+cross join lateral (
+  select
+    case when r.is_cause then r.event_id end as cause_event_id,
+    case when r.is_cause then r.event_timestamp end as cause_ts,
+    case when r.is_cause then r.event_type_code end as cause_code,
+    case when r.is_cause then r.event_description end as cause_desc,
+    case when r.is_cause then r.user_name end as user_name,
+    case when r.is_cause then r.user_profile end as user_profile,
+    case when r.is_cause then r.unit end as unit,
+    case when r.is_cause then r.unit_group end as unit_group,
+    case when r.is_cause then r.handler_name end as handler_name,
+    case when r.is_cause then r.handler_profile end as handler_profile
+) c;
+"""
+
+# Recalcular tudo = marcar o histórico inteiro de cada porta
+_MARK_ALL_SQL = """
+insert into public.passages_v5_dirty (access_name, min_ts, max_ts)
+select e.access_name, min(e.event_timestamp), max(e.event_timestamp)
+from public.events e
+where e.access_name is not null
+  and e.event_timestamp is not null
+group by e.access_name;
+"""
+
+def refresh_passages(full: bool = False) -> dict:
+    """
+    Recalcula passages_v5 / passage_classification_v5 só nas janelas marcadas
+    pelas ingestões (porta + horários com eventos novos, com a folga de 90 s /
+    30 s): apaga as passagens das janelas e grava de novo, numa transação só
+    (quem lê vê o antes ou o depois, nunca pela metade). O custo acompanha o
+    tamanho do lote, não o do histórico.
+
+    full=True recalcula o histórico inteiro (ex.: depois de mudar a lógica das views).
+    Retorna {"windows": janelas recalculadas, "passages": passagens regravadas}.
+    """
+    with connection() as conn:
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select pg_advisory_xact_lock(%s)", (REFRESH_LOCK_KEY,))
+                if full:
+                    cur.execute(_MARK_ALL_SQL)
+                cur.execute(_TAKE_WINDOWS_SQL)
+                cur.execute("select count(*) as n from _passage_windows")
+                windows = cur.fetchone()["n"]
+                passages = 0
+                if windows:
+                    cur.execute(_DELETE_SQL)
+                    cur.execute(_INSERT_PASSAGES_SQL)
+                    cur.execute(_INSERT_CLASSIFICATION_SQL)
+                    passages = cur.rowcount
+            conn.commit()
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+
+    return {"windows": windows, "passages": passages}
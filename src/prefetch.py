@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+from psycopg2 import extensions
+import streamlit as st
+from src.db import connection, rows_to_frame
+
+# Consultas de prefetch rodando ao mesmo tempo (no processo todo)
+PREFETCH_WORKERS = 2
+# Páginas pré-carregadas guardadas por sessão
+PREFETCH_MAX_PAGES = 2
+
+@st.cache_resource
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+class _PrefetchJob:
+    """Uma consulta em segundo plano que pode ser cancelada (inclusive no servidor)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelled = False
+        self.future = None
+
+    def run(self, sql: str, params: dict):
+        with connection() as conn:
+            with self._lock:
+                if self.cancelled:
+                    return None
+                self._conn = conn
+            try:
+                with conn.cursor(cursor_factory=extensions.cursor) as cur:
+                    cur.execute(sql, params)
+                    return rows_to_frame(cur.fetchall(), cur.description)
+            except psycopg2.extensions.QueryCanceledError:
+                if self.cancelled:
+                    return None
+                raise
+            finally:
+                with self._lock:
+                    self._conn = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            if self.future is not None:
+                self.future.cancel()
+            if self._conn is not None:
+                # pede ao PostgreSQL para abortar a query em andamento
+                self._conn.cancel()
+
+class PagePrefetcher:
+    """
+    Pré-carrega páginas do Relatórios em segundo plano, por sessão.
+    Cada página fica guardada pela sua chave (escopo do filtro + fronteira da
+    página anterior); no máximo PREFETCH_MAX_PAGES por sessão (as mais antigas
+    são canceladas/descartadas).
+    """
+
+    def __init__(self, max_pages: int = PREFETCH_MAX_PAGES):
+        self._jobs = OrderedDict()
+        self._max_pages = max_pages
+
+    def submit(self, key, sql: str, params: dict) -> None:
+        if key in self._jobs:
+            return
+        job = _PrefetchJob()
+        job.future = get_prefetch_executor().submit(job.run, sql, dict(params))
+        self._jobs[key] = job
+        while len(self._jobs) > self._max_pages:
+            _, old = self._jobs.popitem(last=False)
+            old.cancel()
+
+    def take(self, key):
+        """
+        DataFrame pré-carregado para a chave (e tira do cache), ou None.
+        Se já está rodando, espera: é a mesma query que seria feita agora e já
+        andou. Se ainda está na fila (atrás de prefetches de outras sessões no
+        executor compartilhado), cancela e devolve None: a página consulta direto
+        em vez de esperar a vez.
+        """
+        job = self._jobs.pop(key, None)
+        if job is None or job.future.cancelled():
+            return None
+        if not job.future.running() and not job.future.done():
+            job.cancel()
+            return None
+        try:
+            return job.future.result()
+        except Exception:
+            return None
+
+    def cancel_all(self) -> None:
+        """Filtros mudaram: nada do que está pré-carregado serve mais."""
+        for job in self._jobs.values():
+            job.cancel()
+        self._jobs.clear()
+
+def get_page_prefetcher() -> PagePrefetcher:
+    """Prefetcher da sessão atual."""
+    if "rel_prefetcher" not in st.session_state:
+        st.session_state.rel_prefetcher = PagePrefetcher()
+    return st.session_state.rel_prefetcher
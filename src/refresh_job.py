@@ -0,0 +1,97 @@
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from src.db import refresh_materialized_views
+from src.passages import refresh_passages
+
+class RefreshJob:
+    """
+    Atualização pós-ingestão em segundo plano, uma por processo:
+    refresh_passages() (janelas marcadas pela ingestão). A página não espera:
+    só consulta status().
+
+    As materialized views (mv_passages_v5 / mv_passage_classification_v5) não
+    são lidas pelo app (a Visão Geral lê a tabela passage_classification_v5) e
+    o refresh delas recalcula o histórico inteiro: só entram com views=True,
+    por pedido explícito (para leitores de fora do app).
+
+    Pedido com o job já rodando não abre outro: marca para rodar de novo no fim
+    (as janelas marcadas nesse meio tempo ficam para essa segunda volta).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+        self._again = False
+        self._again_views = False
+        self._status = {
+            "state": "idle",        # idle | running | done | error
+            "step": None,           # "passagens" | "views" enquanto roda
+            "started_at": None,
+            "finished_at": None,
+            "stats": None,
+            "error": None,
+        }
+
+    def start(self, views: bool = False) -> bool:
+        """
+        Dispara o refresh (views=True: também as materialized views).
+        False se já estava rodando (vai rodar de novo no fim).
+        """
+        with self._lock:
+            if self._status["state"] == "running":
+                self._again = True
+                self._again_views |= views
+                return False
+            self._status.update(state="running", step=None, started_at=time.time(), finished_at=None, error=None)
+            self._executor.submit(self._run, views)
+            return True
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(self._status)
+
+    def _set(self, **values) -> None:
+        with self._lock:
+            self._status.update(values)
+
+    def _run(self, views: bool) -> None:
+        while True:
+            try:
+                self._set(step="passagens")
+                t0 = time.perf_counter()
+                stats = refresh_passages()
+                stats["passages_s"] = time.perf_counter() - t0
+
+                if views:
+                    self._set(step="views")
+                    t1 = time.perf_counter()
+                    refresh_materialized_views()
+                    stats["views_s"] = time.perf_counter() - t1
+
+                # Visão Geral / Relatórios passam a ler os dados novos
+                st.cache_data.clear()
+                self._set(stats=stats, error=None)
+            except Exception:
+                # as janelas que falharam continuam marcadas: o próximo refresh refaz
+                self._set(error=traceback.format_exc())
+
+            with self._lock:
+                if self._again:
+                    views = self._again_views
+                    self._again = self._again_views = False
+                    self._status["started_at"] = time.time()
+                    continue
+                self._status.update(
+                    state="error" if self._status["error"] else "done",
+                    step=None,
+                    finished_at=time.time(),
+                )
+                return
+
+@st.cache_resource
+def get_refresh_job() -> RefreshJob:
+    """Um job por processo (compartilhado entre sessões)."""
+    return RefreshJob()
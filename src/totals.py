@@ -0,0 +1,119 @@
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from src.db import fetch_df
+
+# Totais exatos guardados (por processo) até a próxima ingestão
+TOTALS_CACHE_MAX = 512
+
+@st.cache_data(ttl=5, show_spinner=False)
+def data_version() -> int:
+    """
+    "Versão" dos dados de public.events: quantas cargas já comitaram
+    (public.events_loads, gravada pela ingestão na mesma transação do
+    insert, inclusive pela CLI/spool, fora do app). Serve de chave para
+    invalidar totais em cache. Os contadores do pg_stat não servem: são
+    atualizados com atraso, param com track_counts off e zeram no
+    pg_stat_reset.
+    """
+    rows = fetch_df("select count(*) as version from public.events_loads;")
+    return int(rows[0]["version"]) if rows else 0
+
+class TotalsCache:
+    """
+    Totais exatos por (chave do filtro, versão dos dados), compartilhados entre
+    sessões, mais as contagens em andamento no background (1 por chave) e as
+    que falharam (ex.: statement timeout), que não são disparadas de novo até
+    a próxima versão dos dados.
+    """
+
+    def __init__(self, max_entries: int = TOTALS_CACHE_MAX):
+        self._lock = threading.Lock()
+        self._totals = OrderedDict()
+        self._pending = {}
+        self._failed = OrderedDict()
+        self._max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="count")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._totals:
+                self._totals.move_to_end(key)
+                return self._totals[key]
+            return None
+
+    def put(self, key, total: int) -> None:
+        with self._lock:
+            self._totals[key] = total
+            self._totals.move_to_end(key)
+            while len(self._totals) > self._max_entries:
+                self._totals.popitem(last=False)
+            self._pending.pop(key, None)
+
+    def count_in_background(self, key, count_sql: str, params: dict) -> None:
+        """Dispara o count(*) exato (se já não estiver rodando para essa chave)."""
+        with self._lock:
+            if key in self._totals or key in self._pending or key in self._failed:
+                return
+            self._pending[key] = self._executor.submit(self._count, key, count_sql, params)
+
+    def failed(self, key) -> bool:
+        with self._lock:
+            return key in self._failed
+
+    def _count(self, key, count_sql: str, params: dict) -> None:
+        try:
+            self.put(key, int(fetch_df(count_sql, params)[0]["total"]))
+        except Exception as e:
+            with self._lock:
+                self._failed[key] = str(e)
+                while len(self._failed) > self._max_entries:
+                    self._failed.popitem(last=False)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+@st.cache_resource
+def get_totals_cache() -> TotalsCache:
+    return TotalsCache()
+
+def exact_total(key, count_sql: str, params: dict) -> int:
+    """count(*) exato, calculado uma vez por chave/versão dos dados."""
+    cache = get_totals_cache()
+    full_key = (key, data_version())
+    total = cache.get(full_key)
+    if total is None:
+        total = int(fetch_df(count_sql, params)[0]["total"])
+        cache.put(full_key, total)
+    return total
+
+def estimated_total(select_sql: str, params: dict) -> int:
+    """Estimativa do planner (EXPLAIN, sem executar) de quantas linhas o SELECT devolve."""
+    rows = fetch_df(f"explain (format json) {select_sql}", params)
+    plan = rows[0]["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def fast_total(key, count_sql: str, select_sql: str, params: dict) -> tuple[int, bool]:
+    """
+    (total, exato?). Se o exato já está em cache, devolve ele; senão devolve
+    a estimativa do planner na hora e dispara o count(*) exato no background
+    (a próxima execução da página já pega o número certo).
+    """
+    cache = get_totals_cache()
+    full_key = (key, data_version())
+    total = cache.get(full_key)
+    if total is not None:
+        return total, True
+    cache.count_in_background(full_key, count_sql, params)
+    return estimated_total(select_sql, params), False
+
+def total_ready(key) -> bool:
+    return get_totals_cache().get((key, data_version())) is not None
+
+def total_failed(key) -> bool:
+    """O count(*) exato em background falhou (fica a estimativa)."""
+    return get_totals_cache().failed((key, data_version()))
@@ -0,0 +1,162 @@
+"""
+tools/bench_kiper_table.py
+
+Benchmark do HTML da tabela do Relatórios: montagem antiga (iterrows, um
+strftime/html.escape/canonical_profile por linha) x _kiper_rows_html
+(coluna a coluna + badge por perfil distinto + um join). Confere que o
+HTML sai idêntico.
+
+A referência roda com os textos nulos como None (como o dict do fetch_df
+virava linha antes): com o dtype str do pandas 3, nulo chega como NaN e o
+`x or ""` antigo escrevia "nan" na tabela.
+
+Uso (na raiz do repo):
+    python -m tools.bench_kiper_table            # 1000 linhas (maior página)
+    python -m tools.bench_kiper_table 5000 --repeat 20
+"""
+
+import sys
+import html
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from src.helpers import _kiper_rows_html, kiper_badge
+
+
+def legacy_rows_html(df_raw: pd.DataFrame) -> str:
+    """Implementação original (referência), copiada de render_kiper_table."""
+    rows_html = []
+    for _, r in df_raw.iterrows():
+        dt = r.get("event_timestamp")
+        if pd.notnull(dt):
+            date_str = dt.strftime("%d/%m/%Y")
+            time_str = dt.strftime("%H:%M:%S")
+        else:
+            date_str, time_str = "", ""
+
+        desc_lines = str(r.get("descricao") or "").split("\n")
+        desc_html = "".join(
+            [f"<p class='kiper-line'>{html.escape(line)}</p>" for line in desc_lines if line]
+        )
+
+        user_name = str(r.get("user_name") or "").strip()
+        user_profile = str(r.get("user_profile") or "").strip()
+
+        user_html_parts = []
+        if user_name:
+            user_html_parts.append(f"<span class='kiper-name'>{html.escape(user_name)}</span>")
+        if user_profile:
+            user_html_parts.append(kiper_badge(user_profile))
+        user_html = (
+            "<div class='cell-stack'>" + "".join(user_html_parts) + "</div>"
+            if user_html_parts else ""
+        )
+
+        ug = str(r.get("unit_group") or "").strip()
+        un = str(r.get("unit") or "").strip()
+
+        gu_html = "<div class='cell-stack'>"
+        if ug:
+            gu_html += f"<p class='kiper-line'>{html.escape(ug)}</p>"
+        if un:
+            gu_html += f"<p class='kiper-line'>{html.escape(un)}</p>"
+        gu_html += "</div>"
+
+        treatment = str(r.get("treatment") or "").strip()
+        reg_html = f"<p class='kiper-line'>{html.escape(treatment)}</p>"
+
+        rows_html.append(
+            f"""
+            <tr class="row-hover">
+              <td class="col-date">
+                <div class="cell-stack">
+                  <div>{html.escape(date_str)}</div>
+                  <div class="kiper-muted">{html.escape(time_str)}</div>
+                </div>
+              </td>
+              <td class="col-desc">{desc_html}</td>
+              <td class="col-user">{user_html}</td>
+              <td class="col-gu">{gu_html}</td>
+              <td class="col-reg">{reg_html}</td>
+            </tr>
+            """
+        )
+    return "".join(rows_html)
+
+
+def synthetic_page(n: int, seed: int = 42) -> pd.DataFrame:
+    """Página do Relatórios (mesmas colunas da query), com nulos, acentos e caracteres de HTML."""
+    rng = random.Random(seed)
+    base = datetime(2025, 12, 1)
+    profiles = ["Morador", "morador/proprietario", "Prestador de Servico ", "Zelador",
+                "Convidado", "Perfil <novo>", "  ", None]
+    names = ["Ana Souza", "João D'Ávila", "M&M Serviços", "  Carlos  ", "<script>", None]
+    groups = ["Bloco HYPE RES", "Bloco HYPE NR", None]
+    descs = ["165 - Porta aberta\nPortão Social", "701 - Acesso facial\nHall \"RES\"",
+             "\n177 - Tag\n\nGaragem\n", "311 - Controle remoto", "", None]
+    treatments = ["Atendido", "Sem tratamento", "<b>ok</b> & fechado", None]
+
+    ts = [base + timedelta(seconds=rng.randint(0, 45 * 86400)) for _ in range(n)]
+    for i in range(0, n, 97):
+        ts[i] = None
+    df = pd.DataFrame({
+        "event_timestamp": pd.to_datetime(pd.Series(ts, dtype=object)),
+        "event_id": [f"{i:040x}" for i in range(n)],
+        "descricao": [rng.choice(descs) for _ in range(n)],
+        "user_name": [rng.choice(names) for _ in range(n)],
+        "user_profile": [rng.choice(profiles) for _ in range(n)],
+        "unit_group": [rng.choice(groups) for _ in range(n)],
+        "unit": [rng.choice(["101", "1203", "Loja 2", None]) for _ in range(n)],
+        "treatment": [rng.choice(treatments) for _ in range(n)],
+    })
+    return df
+
+
+def as_legacy_input(df: pd.DataFrame) -> pd.DataFrame:
+    """Textos nulos como None (object), como chegavam ao iterrows antes do dtype str."""
+    out = df.copy()
+    for c in out.columns:
+        if c != "event_timestamp":
+            out[c] = out[c].astype(object).where(out[c].notna(), None)
+    return out
+
+
+def timed(fn, df, repeat: int) -> tuple[str, float]:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(df)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark/paridade do HTML da tabela estilo Kiper.")
+    parser.add_argument("rows", nargs="?", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    df = synthetic_page(args.rows)
+    old, t_old = timed(legacy_rows_html, as_legacy_input(df), args.repeat)
+    new, t_new = timed(_kiper_rows_html, df, args.repeat)
+
+    print(
+        f"{len(df):,} linhas | antigo {t_old * 1000:7.1f}ms | novo {t_new * 1000:7.1f}ms | "
+        f"{t_old / t_new:5.1f}x | HTML {len(new) / 1024:,.0f} KB"
+    )
+    if old != new:
+        pos = next(i for i, (a, b) in enumerate(zip(old, new)) if a != b) if len(old) == len(new) else min(len(old), len(new))
+        print(f"[ERRO] HTML diferente a partir do caractere {pos}:")
+        print("  antigo:", repr(old[max(0, pos - 80):pos + 80]))
+        print("  novo:  ", repr(new[max(0, pos - 80):pos + 80]))
+        return 1
+    print("[OK] HTML idêntico.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
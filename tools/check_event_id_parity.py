@@ -0,0 +1,117 @@
+"""
+tools/check_event_id_parity.py
+
+Confere se o build_event_ids (vetorizado) gera exatamente os mesmos event_id
+que o make_key antigo (df.apply linha a linha). Se divergir, eventos já
+gravados deixariam de bater no ON CONFLICT (event_id) e viriam duplicados.
+
+Uso (na raiz do repo):
+    python -m tools.check_event_id_parity                 # dados sintéticos
+    python -m tools.check_event_id_parity export.csv ...  # CSVs reais do Kiper
+"""
+
+import sys
+import time
+import random
+import hashlib
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from src.ingest import EVENT_KEY_COLUMNS, build_event_ids, normalize_kiper_csv, read_kiper_csv
+
+
+def legacy_event_ids(df: pd.DataFrame) -> pd.Series:
+    """Implementação original (referência), copiada de normalize_kiper_csv."""
+    def make_key(row):
+        parts = []
+        for c in EVENT_KEY_COLUMNS:
+            v = row[c]
+            parts.append("" if pd.isna(v) else str(v))
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+    return df.apply(make_key, axis=1)
+
+
+def synthetic_kiper_df(n: int, seed: int = 42) -> pd.DataFrame:
+    """CSV "cru" no formato do Kiper, com nulos, acentos e datas inválidas."""
+    rng = random.Random(seed)
+    base = datetime(2025, 12, 1)
+    accesses = ["Portão Social", "Garagem Entrada", "Hall Bloco RES", "Eclusa NR", None]
+    descs = ["Porta aberta", "Porta fechada", "Acesso por facial", "Botoeira", "Comando app", None]
+    names = ["José da Silva", "Ana Conceição", "", None, "Prestador ÇÃÕ"]
+    units = ["Apartamento 1702", "Apartamento 000", "Sala 203", None]
+
+    rows = []
+    for _ in range(n):
+        ts = base + timedelta(seconds=rng.randint(0, 60 * 60 * 24 * 45))
+        r = rng.random()
+        if r < 0.01:
+            ts_txt = "data inválida"
+        elif r < 0.02:
+            ts_txt = None
+        else:
+            ts_txt = ts.strftime("%d/%m/%Y %H:%M:%S")
+
+        code = rng.choice(["165", "166", "167", "177", "701", "708", "311", "", "x"])
+        rows.append({
+            "Data do evento": ts_txt,
+            "Data da finalização do tratamento": None,
+            "Tipo do evento": code,
+            "Descrição do evento": rng.choice(descs),
+            "Nome do accesso": rng.choice(accesses),
+            "Nome do usuário": rng.choice(names),
+            "Perfil do usuário": rng.choice(["Morador", "Funcionário", None]),
+            "Grupo de Unidade": rng.choice(["Bloco HYPE RES", "Bloco HYPE NR", None]),
+            "Unidade": rng.choice(units),
+            "Perfil do atendente": None,
+            "Nome do atendente": None,
+            "Tratamento": rng.choice(["", "Ok", None]),
+        })
+    return pd.DataFrame(rows)
+
+
+def check(df_norm: pd.DataFrame, label: str) -> bool:
+    t0 = time.perf_counter()
+    old = legacy_event_ids(df_norm)
+    t1 = time.perf_counter()
+    new = build_event_ids(df_norm)
+    t2 = time.perf_counter()
+
+    diff = (old != new)
+    ok = not diff.any()
+    status = "OK" if ok else f"FALHOU ({int(diff.sum())} divergências)"
+    print(
+        f"[{status}] {label}: {len(df_norm):,} linhas | "
+        f"antigo {t1 - t0:.2f}s | vetorizado {t2 - t1:.2f}s"
+    )
+    if not ok:
+        print(df_norm.loc[diff, EVENT_KEY_COLUMNS].head(10).to_string())
+    return ok
+
+
+def main():
+    paths = sys.argv[1:]
+    results = []
+
+    if paths:
+        for path in paths:
+            with open(path, "rb") as f:
+                df_norm = normalize_kiper_csv(read_kiper_csv(f), source_file=path)
+            results.append(check(df_norm, path))
+    else:
+        df_norm = normalize_kiper_csv(synthetic_kiper_df(50_000), source_file="synthetic.csv")
+        results.append(check(df_norm, "sintético"))
+
+        # Frações de segundo: str(Timestamp) muda de formato, precisa bater também
+        df_frac = df_norm.head(1_000).copy()
+        df_frac["event_timestamp"] = df_frac["event_timestamp"] + pd.to_timedelta(
+            [i % 3 * 250 for i in range(len(df_frac))], unit="ms"
+        )
+        results.append(check(df_frac, "sintético com milissegundos"))
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
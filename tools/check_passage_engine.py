@@ -0,0 +1,167 @@
+"""
+tools/check_passage_engine.py
+
+Confere se o motor em NumPy (src/passage_engine.py) devolve exatamente o mesmo
+que as views de referência (sql_query/: vw_passages_v5 e
+vw_passage_classification_v5), e mede os dois.
+
+- Passagens: pair_passages x SELECT do vw_passages_v5.
+- Classificação: classify_passages x SELECT do vw_passage_classification_v5,
+  os dois sobre as mesmas passagens (as do SQL, gravadas numa tabela temporária).
+- Diferença por open_event_id, coluna a coluna (NULL = NULL).
+
+Sem argumentos roda sobre public.events. Com --synthetic N gera N eventos
+sintéticos (mesmo gerador do tools/check_passages_parity.py: horários em
+segundos, então há empates). --close-window / --cause-window trocam as janelas
+nos dois lados (as views com o intervalo substituído no texto).
+
+Conexão: DATABASE_URL no ambiente (ou .env); sem isso, cai no st.secrets.
+
+Uso (na raiz do repo):
+    python -m tools.check_passage_engine --synthetic 200000 --doors 40
+    python -m tools.check_passage_engine --synthetic 200000 --close-window 120 --cause-window 10
+    python -m tools.check_passage_engine
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+import time
+import argparse
+
+import pandas as pd
+import psycopg2
+
+from src.db import get_database_url, rows_to_frame
+from src.passages import CLOSE_WINDOW_S, CAUSE_WINDOW_S
+from src.passage_engine import EVENT_COLUMNS, EventStore, pair_passages, classify_passages
+from tools.check_passages_parity import SYNTHETIC_SQL, new_passages_sql, new_classification_sql
+
+
+def with_windows(sql: str, close_window_s: int, cause_window_s: int) -> str:
+    """Troca as janelas fixas da view (90 s / 30 s) pelas pedidas."""
+    return (
+        sql.replace(f"interval '{CLOSE_WINDOW_S} seconds'", f"interval '{close_window_s} seconds'")
+        .replace(f"interval '{CAUSE_WINDOW_S} seconds'", f"interval '{cause_window_s} seconds'")
+    )
+
+
+def fetch(cur, sql: str) -> pd.DataFrame:
+    cur.execute(sql)
+    return rows_to_frame(cur.fetchall(), cur.description)
+
+
+def normalized(df: pd.DataFrame) -> pd.DataFrame:
+    """Mesmos tipos dos dois lados (timestamps em µs, NULL como None/NaT/NA)."""
+    df = df.copy()
+    for col in df.columns:
+        if col.endswith("_ts"):
+            df[col] = pd.to_datetime(df[col]).astype("datetime64[us]")
+        elif col in ("seconds_open", "cause_code"):
+            df[col] = df[col].astype("Int64")
+        elif col.startswith("has_"):
+            df[col] = df[col].astype(bool)
+    return df.sort_values("open_event_id").reset_index(drop=True)
+
+
+def compare(label: str, sql_df: pd.DataFrame, engine_df: pd.DataFrame, show: int) -> int:
+    """Imprime as divergências (por open_event_id). Retorna quantas linhas divergem."""
+    sql_df, engine_df = normalized(sql_df), normalized(engine_df)
+    if list(sql_df.columns) != list(engine_df.columns):
+        print(f"[ERRO] {label}: colunas diferentes: {list(sql_df.columns)} x {list(engine_df.columns)}")
+        return 1
+
+    merged = sql_df.merge(engine_df, on="open_event_id", how="outer", suffixes=("_sql", "_motor"), indicator=True)
+    bad = merged["_merge"] != "both"
+    for col in sql_df.columns:
+        if col == "open_event_id":
+            continue
+        a, b = merged[f"{col}_sql"], merged[f"{col}_motor"]
+        same = (a == b).fillna(False).astype(bool) | (a.isna() & b.isna())
+        diff = ~same & ~bad
+        if diff.any():
+            print(f"  {col}: {int(diff.sum()):,} diferença(s)")
+        bad |= diff
+
+    if bad.any():
+        print(f"[ERRO] {label}: {int(bad.sum()):,} linhas diferentes. Primeiras:")
+        with pd.option_context("display.max_columns", None, "display.width", 200):
+            print(merged[bad].head(show).to_string())
+    else:
+        print(f"[OK] {label}: {len(sql_df):,} passagens, resultado idêntico.")
+    return int(bad.sum())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Paridade/tempo do motor NumPy de passagens x views SQL.")
+    ap.add_argument("--synthetic", type=int, metavar="N", help="gera N eventos sintéticos (tabela temporária)")
+    ap.add_argument("--doors", type=int, default=300, help="portas nos dados sintéticos")
+    ap.add_argument("--close-window", type=int, default=CLOSE_WINDOW_S, help="segundos até o fechamento (default 90)")
+    ap.add_argument("--cause-window", type=int, default=CAUSE_WINDOW_S, help="segundos de causa antes da abertura (default 30)")
+    ap.add_argument("--show", type=int, default=20, help="quantas linhas divergentes mostrar")
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(get_database_url())
+    conn.autocommit = True
+    failed = 0
+    try:
+        with conn.cursor() as cur:
+            events = "public.events"
+            if args.synthetic:
+                span = max(args.synthetic // args.doors, 1) * 60
+                cur.execute("select setseed(0.42)")
+                cur.execute(SYNTHETIC_SQL, {"n": args.synthetic, "doors": args.doors, "span": span})
+                print(f"tabela sintética: {args.synthetic:,} eventos, {args.doors} portas")
+                events = "bench_events"
+
+            passages_sql = with_windows(new_passages_sql(events), args.close_window, args.cause_window)
+            classification_sql = with_windows(
+                new_classification_sql(events, "bench_passages"), args.close_window, args.cause_window
+            )
+
+            t0 = time.perf_counter()
+            sql_passages = fetch(cur, passages_sql)
+            sql_passages_s = time.perf_counter() - t0
+            cur.execute(f"create temp table bench_passages as {passages_sql}")
+            cur.execute("analyze bench_passages")
+            t0 = time.perf_counter()
+            sql_classification = fetch(cur, classification_sql)
+            sql_classification_s = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            frame = fetch(cur, f"select {', '.join(EVENT_COLUMNS)} from {events}")
+            read_s = time.perf_counter() - t0
+    finally:
+        conn.close()
+
+    t0 = time.perf_counter()
+    store = EventStore.from_frame(frame)
+    store_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    passages = pair_passages(store, args.close_window)
+    passages_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    classification = classify_passages(store, sql_passages, args.close_window, args.cause_window)
+    classification_s = time.perf_counter() - t0
+
+    print(
+        f"eventos: {len(frame):,} lidos em {read_s:.1f}s | store em {store_s:.2f}s "
+        f"(janelas: fechamento {args.close_window}s, causa {args.cause_window}s)"
+    )
+    print(f"passagens      SQL {sql_passages_s:7.2f}s | motor {passages_s:7.2f}s")
+    print(f"classificação  SQL {sql_classification_s:7.2f}s | motor {classification_s:7.2f}s")
+
+    failed += compare("passagens", sql_passages, passages, args.show)
+    failed += compare("classificação", sql_classification, classification, args.show)
+
+    # a classificação em cima das passagens do próprio motor (fluxo de uso normal)
+    own = classify_passages(store, passages, args.close_window, args.cause_window)
+    failed += compare("motor completo", sql_classification, own, args.show)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+tools/check_passages_parity.py
+
+Confere se as views de passagem reescritas devolvem exatamente o mesmo que as
+versões antigas, e mede as duas:
+
+- vw_passages_v5 (uma ordenação + window function) x LEFT JOIN LATERAL (um
+  probe no índice por abertura 165);
+- vw_passage_classification_v5 (uma busca por passagem + bool_or) x causa por
+  LATERAL + três EXISTS (quatro probes por passagem). As duas leem as mesmas
+  passagens (gravadas antes numa tabela temporária), então a medição é só
+  da classificação.
+
+- Diferença: (antiga EXCEPT ALL nova) + (nova EXCEPT ALL antiga), em todas as
+  colunas. As antigas aqui desempatam eventos no mesmo segundo por event_id
+  (as originais pegavam qualquer um deles, então nem elas repetiam o resultado
+  nesse caso).
+- Tempo: EXPLAIN ANALYZE de cada consulta (sem mandar as linhas para o cliente).
+
+Sem argumentos roda sobre public.events. Com --synthetic N gera N eventos
+sintéticos numa tabela temporária (mesmos índices da base) e compara lá.
+
+Conexão: DATABASE_URL no ambiente (ou .env); sem isso, cai no st.secrets.
+
+Uso (na raiz do repo):
+    python -m tools.check_passages_parity
+    python -m tools.check_passages_parity --view classification
+    python -m tools.check_passages_parity --synthetic 3000000 --doors 300 --work-mem 64MB
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import psycopg2
+
+from src.db import get_database_url
+
+SQL_DIR = Path(__file__).resolve().parent.parent / "sql_query"
+PASSAGES_FILE = SQL_DIR / "generate public-vw_passages_V5"
+CLASSIFICATION_FILE = SQL_DIR / "generate public-vw_passage_classification_v5"
+
+# Versão original do vw_passages_v5 (referência), com desempate por event_id
+LEGACY_PASSAGES_SQL = """
+with opens as (
+  select
+    e.event_id as open_event_id,
+    e.event_timestamp as open_ts,
+    e.access_name as door_access_name
+  from {events} e
+  where e.event_type_code = 165
+    and e.access_name is not null
+),
+closed as (
+  select
+    o.open_event_id,
+    c.event_id as close_event_id,
+    c.event_timestamp as close_ts
+  from opens o
+  left join lateral (
+    select e2.*
+    from {events} e2
+    where e2.access_name = o.door_access_name
+      and e2.event_type_code = 167
+      and e2.event_timestamp >= o.open_ts
+      and e2.event_timestamp <= o.open_ts + interval '90 seconds'
+    order by e2.event_timestamp, e2.event_id
+    limit 1
+  ) c on true
+)
+select
+  o.open_event_id,
+  o.open_ts,
+  c.close_event_id,
+  c.close_ts,
+  case
+    when c.close_ts is not null then extract(epoch from (c.close_ts - o.open_ts))::int
+    else null
+  end as seconds_open,
+  o.door_access_name
+from opens o
+left join closed c
+  on c.open_event_id = o.open_event_id
+"""
+
+# Versão original do vw_passage_classification_v5 (referência), com desempate da causa por event_id
+LEGACY_CLASSIFICATION_SQL = """
+with p as (
+  select *
+  from {passages}
+),
+cause as (
+  select
+    p.open_event_id,
+    ce.event_id as cause_event_id,
+    ce.event_timestamp as cause_ts,
+    ce.event_type_code as cause_code,
+    ce.event_description as cause_desc,
+    ce.user_name,
+    ce.user_profile,
+    ce.unit,
+    ce.unit_group,
+    ce.handler_name,
+    ce.handler_profile
+  from p
+  left join lateral (
+    select e.*
+    from {events} e
+    where e.access_name = p.door_access_name
+      and e.event_timestamp <= p.open_ts
+      and e.event_timestamp >= p.open_ts - interval '30 seconds'
+      and e.event_type_code in (177,701,708,311)
+    order by e.event_timestamp desc, e.event_id
+    limit 1
+  ) ce on true
+),
+flags as (
+  select
+    p.open_event_id,
+    exists (
+      select 1
+      from {events} e
+      where e.access_name = p.door_access_name
+        and e.event_timestamp >= p.open_ts
+        and e.event_timestamp <= coalesce(p.close_ts, p.open_ts + interval '90 seconds')
+        and e.event_type_code = 166
+    ) as has_held_open,
+    exists (
+      select 1
+      from {events} e
+      where e.access_name = p.door_access_name
+        and e.event_timestamp >= p.open_ts
+        and e.event_timestamp <= coalesce(p.close_ts, p.open_ts + interval '90 seconds')
+        and e.event_type_code in (112,113,114)
+    ) as has_failed_close,
+    exists (
+      select 1
+      from {events} e
+      where e.access_name = p.door_access_name
+        and e.event_timestamp >= p.open_ts
+        and e.event_timestamp <= coalesce(p.close_ts, p.open_ts + interval '90 seconds')
+        and e.event_type_code = 411
+    ) as has_door_alert
+  from p
+)
+select
+  p.open_event_id,
+  p.open_ts,
+  p.close_ts,
+  p.seconds_open,
+  p.door_access_name,
+  c.cause_event_id,
+  c.cause_ts,
+  c.cause_code,
+  c.cause_desc,
+  c.user_name,
+  c.user_profile,
+  c.unit,
+  c.unit_group,
+  c.handler_name,
+  c.handler_profile,
+  f.has_held_open,
+  f.has_failed_close,
+  f.has_door_alert,
+  case
+    when c.cause_code = 701 then 'entrada_facial'
+    when c.cause_code = 708 then 'entrada_convidado_facial'
+    when c.cause_code = 177 then 'saida_botoeira'
+    when c.cause_code = 311 then 'comando_app'
+    when c.cause_code is null then 'sem_causa'
+    else 'outro'
+  end as passage_kind,
+  case
+    when c.cause_code is null then 'baixa'
+    when extract(epoch from (p.open_ts - c.cause_ts)) <= 5 then 'alta'
+    else 'media'
+  end as confianca_causa
+from p
+left join cause c on c.open_event_id = p.open_event_id
+left join flags f on f.open_event_id = p.open_event_id
+"""
+
+# Consulta de regressão: linhas que só aparecem de um dos lados
+DIFF_SQL = """
+with antiga as ({legacy}),
+nova as ({new})
+select 'só na antiga' as lado, d.*
+from (select * from antiga except all select * from nova) d
+union all
+select 'só na nova' as lado, d.*
+from (select * from nova except all select * from antiga) d
+order by open_ts, open_event_id, lado
+"""
+
+# Eventos sintéticos: ~30% aberturas, ~28% fechamentos, resto causas/alertas,
+# horário em segundos (como no Kiper, então há empates), ~1% sem porta,
+# ~0,5% sem código.
+# Gravados em ordem de horário, como chegam as ingestões.
+SYNTHETIC_SQL = """
+create temp table bench_events as
+select
+  md5(g::text) as event_id,
+  timestamp '2025-01-01' + floor(random() * %(span)s) * interval '1 second' as event_timestamp,
+  s.code as event_type_code,
+  'Evento ' || s.code as event_description,
+  case when random() < 0.01 then null else 'Porta ' || (g %% %(doors)s) end as access_name,
+  case when s.code in (701, 708, 311) then 'Morador ' || (g %% 997) end as user_name,
+  case when s.code in (701, 708, 311) then 'Morador' end as user_profile,
+  case when s.code in (701, 708, 311) then 'Apartamento ' || (g %% 211) end as unit,
+  case when s.code in (701, 708, 311) then 'Bloco ' || (g %% 3) end as unit_group,
+  case when s.code = 311 then 'Portaria' end as handler_name,
+  case when s.code = 311 then 'Operador' end as handler_profile
+from (
+  select
+    g,
+    case
+      when r < 0.30 then 165
+      when r < 0.58 then 167
+      when r < 0.68 then 166
+      when r < 0.76 then 177
+      when r < 0.84 then 701
+      when r < 0.90 then 708
+      when r < 0.96 then 311
+      when r < 0.99 then 112
+      when r < 0.995 then 411
+      else null
+    end as code
+  from (select g, random() as r from generate_series(1, %(n)s) g) x
+) s
+order by event_timestamp;
+create index on bench_events (access_name, event_type_code, event_timestamp);
+create index on bench_events (access_name, event_timestamp);
+analyze bench_events;
+"""
+
+
+def view_select(path: Path, view: str, **tables: str) -> str:
+    """SELECT de uma view do sql_query, com as tabelas trocadas (ex.: public.events -> bench_events)."""
+    ddl = path.read_text(encoding="utf-8")
+    ddl = re.sub(r"/\*.*?\*/", "", ddl, flags=re.S)
+    select = re.split(rf"create or replace view {re.escape(view)} as", ddl, maxsplit=1)[1]
+    select = select.strip().rstrip(";")
+    for old, new in tables.items():
+        select = select.replace(old, new)
+    return select
+
+
+def new_passages_sql(events: str) -> str:
+    """SELECT do vw_passages_v5 atual (lido do sql_query), apontado para outra tabela."""
+    return view_select(PASSAGES_FILE, "public.vw_passages_v5", **{"public.events": events})
+
+
+def new_classification_sql(events: str, passages: str) -> str:
+    """SELECT do vw_passage_classification_v5 atual, lendo outras tabelas de eventos/passagens."""
+    return view_select(
+        CLASSIFICATION_FILE,
+        "public.vw_passage_classification_v5",
+        **{"public.vw_passages_v5": passages, "public.events": events},
+    )
+
+
+def execution_ms(cur, sql: str) -> float:
+    cur.execute(f"explain (analyze, timing off, format json) {sql}")
+    plan = cur.fetchone()[0]
+    return float(plan[0]["Execution Time"])
+
+
+def compare(cur, label: str, legacy: str, new: str, show: int) -> int:
+    """Mede antiga x nova e imprime as divergências. Retorna quantas linhas divergem."""
+    cur.execute(f"select count(*) from ({new}) x")
+    rows = cur.fetchone()[0]
+    old_ms = execution_ms(cur, legacy)
+    new_ms = execution_ms(cur, new)
+    print(
+        f"{label:<14} {rows:>10,} passagens | antiga {old_ms / 1000:7.2f}s | nova {new_ms / 1000:7.2f}s | "
+        f"{old_ms / new_ms:5.1f}x"
+    )
+
+    cur.execute(DIFF_SQL.format(legacy=legacy, new=new))
+    diff = cur.fetchall()
+    if diff:
+        print(f"[ERRO] {label}: {len(diff):,} linhas diferentes. Primeiras:")
+        for row in diff[:show]:
+            print("  ", row)
+    else:
+        print(f"[OK] {label}: resultado idêntico.")
+    return len(diff)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Paridade/tempo das views de passagem reescritas.")
+    ap.add_argument("--view", choices=["passages", "classification", "all"], default="all")
+    ap.add_argument("--synthetic", type=int, metavar="N", help="gera N eventos sintéticos (tabela temporária)")
+    ap.add_argument("--doors", type=int, default=300, help="portas nos dados sintéticos")
+    ap.add_argument("--work-mem", help="work_mem da sessão para as medições (ex.: 64MB)")
+    ap.add_argument("--show", type=int, default=20, help="quantas linhas divergentes mostrar")
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(get_database_url())
+    conn.autocommit = True
+    failed = 0
+    try:
+        with conn.cursor() as cur:
+            if args.work_mem:
+                cur.execute("select set_config('work_mem', %s, false)", (args.work_mem,))
+            events = "public.events"
+            if args.synthetic:
+                # ~60 s entre eventos da mesma porta
+                span = max(args.synthetic // args.doors, 1) * 60
+                t0 = time.perf_counter()
+                cur.execute("select setseed(0.42)")
+                cur.execute(SYNTHETIC_SQL, {"n": args.synthetic, "doors": args.doors, "span": span})
+                print(f"tabela sintética: {args.synthetic:,} eventos, {args.doors} portas ({time.perf_counter() - t0:.1f}s)")
+                events = "bench_events"
+
+            if args.view in ("passages", "all"):
+                legacy = LEGACY_PASSAGES_SQL.format(events=events)
+                failed += compare(cur, "passagens", legacy, new_passages_sql(events), args.show)
+
+            if args.view in ("classification", "all"):
+                cur.execute(f"create temp table bench_passages as {new_passages_sql(events)}")
+                cur.execute("analyze bench_passages")
+                legacy = LEGACY_CLASSIFICATION_SQL.format(events=events, passages="bench_passages")
+                new = new_classification_sql(events, "bench_passages")
+                failed += compare(cur, "classificação", legacy, new, args.show)
+    finally:
+        conn.close()
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+tools/check_passages_tables.py
+
+Confere se as tabelas mantidas pelo refresh incremental (passages_v5 /
+passage_classification_v5) batem com as views de referência
+(vw_passages_v5 / vw_passage_classification_v5) sobre o public.events atual.
+Diferença = janela que o refresh incremental deixou de recalcular.
+
+Com --refresh roda antes o refresh_passages() (o que estiver marcado).
+
+Conexão: DATABASE_URL no ambiente (ou .env); sem isso, cai no st.secrets.
+
+Uso (na raiz do repo):
+    python -m tools.check_passages_tables
+    python -m tools.check_passages_tables --refresh
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+import time
+import argparse
+
+from src.db import fetch_df
+from src.passages import refresh_passages
+from tools.check_passages_parity import DIFF_SQL
+
+PAIRS = [
+    ("passagens", "public.passages_v5", "public.vw_passages_v5"),
+    ("classificação", "public.passage_classification_v5", "public.vw_passage_classification_v5"),
+]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tabelas de passagens x views de referência.")
+    ap.add_argument("--refresh", action="store_true", help="roda o refresh incremental antes de comparar")
+    ap.add_argument("--show", type=int, default=20, help="quantas linhas divergentes mostrar")
+    args = ap.parse_args()
+
+    if args.refresh:
+        t0 = time.perf_counter()
+        stats = refresh_passages()
+        print(f"refresh: {stats['passages']:,} passagens em {stats['windows']:,} janela(s) ({time.perf_counter() - t0:.1f}s)")
+
+    failed = 0
+    for label, table, view in PAIRS:
+        # "antiga" = view de referência, "nova" = tabela
+        diff = fetch_df(DIFF_SQL.format(legacy=f"select * from {view}", new=f"select * from {table}"))
+        if diff:
+            failed += 1
+            print(f"[ERRO] {label}: {len(diff):,} linhas diferentes entre {table} e {view}. Primeiras:")
+            for row in diff[: args.show]:
+                print("  ", dict(row))
+        else:
+            print(f"[OK] {label}: {table} igual a {view}.")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
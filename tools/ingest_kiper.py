@@ -0,0 +1,127 @@
+"""
+tools/ingest_kiper.py
+
+Ingestão de CSVs do Kiper pela linha de comando (backfills / cron), sem
+passar pelo upload do Streamlit.
+
+- Aceita arquivos, diretórios (pega os *.csv) e globs
+- Lê/normaliza em paralelo e grava com o caminho rápido (COPY + merge)
+- Respeita o ingest_manifest (pula arquivos já carregados)
+- Recalcula as passagens UMA vez no final (só portas/horários que o lote tocou)
+- Mostra throughput em linhas/s
+
+Conexão: DATABASE_URL no ambiente (ou .env); sem isso, cai no st.secrets.
+
+Uso (na raiz do repo):
+    python -m tools.ingest_kiper exports/2025/ "exports/jan-*.csv" --workers 4
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+from src.ingest import ingest_kiper_files_parallel, default_ingest_workers
+from src.passages import refresh_passages
+
+
+def expand_inputs(inputs: list[str]) -> list[str]:
+    """Arquivos, diretórios e globs -> lista ordenada e sem repetição de CSVs."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(glob.glob(os.path.join(item, "*.csv")))
+        elif any(ch in item for ch in "*?["):
+            paths.extend(glob.glob(item, recursive=True))
+        else:
+            paths.append(item)
+
+    seen = set()
+    out = []
+    for p in sorted(paths):
+        real = os.path.realpath(p)
+        if real not in seen:
+            seen.add(real)
+            out.append(p)
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ingestão de CSVs do Kiper em public.events.")
+    parser.add_argument("inputs", nargs="+", help="arquivos .csv, diretórios ou globs")
+    parser.add_argument("--workers", type=int, default=default_ingest_workers(),
+                        help="processos lendo/normalizando em paralelo (padrão: %(default)s)")
+    parser.add_argument("--no-manifest", action="store_true",
+                        help="não consulta/grava o ingest_manifest (reprocessa tudo)")
+    parser.add_argument("--skip-covered", action="store_true",
+                        help="não envia linhas de portas/horários já cobertos por arquivos do manifest "
+                             "(só se os arquivos anteriores eram exports completos)")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="não recalcula as passagens no final")
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    missing = [p for p in paths if not os.path.isfile(p)]
+    if missing:
+        print(f"[ERRO] Arquivo(s) não encontrado(s): {', '.join(missing)}", file=sys.stderr)
+        return 2
+    if not paths:
+        print("[OK] Nenhum CSV encontrado.")
+        return 0
+
+    print(f"[..] {len(paths)} arquivo(s) • {args.workers} processo(s)")
+
+    totals = {"rows_raw": 0, "events": 0, "failed": 0, "skipped": 0}
+
+    def on_file(info):
+        if info["error"]:
+            totals["failed"] += 1
+            print(f"[ERRO] {info['file']}: {info['error']}")
+            return
+        if info["skipped"]:
+            totals["skipped"] += 1
+            print(f"[PULA] {info['skipped']}")
+            return
+
+        totals["rows_raw"] += info["rows_raw"]
+        totals["events"] += info["events"]
+        secs = (info["parse_s"] or 0) + (info["load_s"] or 0)
+        rate = info["events"] / secs if secs else 0
+        covered = f" ({info['covered']:,} já cobertos, não enviados)" if info["covered"] else ""
+        print(
+            f"[OK] {info['file']}: {info['events']:,} eventos • {info['inserted']:,} novos • "
+            f"{info['duplicates']:,} duplicados{covered} • leitura {info['parse_s']:.1f}s • "
+            f"gravação {info['load_s']:.1f}s • {rate:,.0f} linhas/s"
+        )
+
+    t0 = time.perf_counter()
+    inserted, duplicates = ingest_kiper_files_parallel(
+        paths, max_workers=args.workers, on_file=on_file, use_manifest=not args.no_manifest,
+        skip_covered=args.skip_covered,
+    )
+    elapsed = time.perf_counter() - t0
+
+    print(
+        f"[OK] Total: {totals['events']:,} eventos ({totals['rows_raw']:,} linhas) em {elapsed:.1f}s • "
+        f"{totals['events'] / elapsed if elapsed else 0:,.0f} linhas/s • "
+        f"{inserted:,} novos • {duplicates:,} duplicados • "
+        f"{totals['skipped']} pulado(s) • {totals['failed']} com erro"
+    )
+
+    if not args.no_refresh and inserted:
+        t1 = time.perf_counter()
+        stats = refresh_passages()
+        print(
+            f"[OK] {stats['passages']:,} passagens recalculadas ({stats['windows']:,} janela(s)) "
+            f"em {time.perf_counter() - t1:.1f}s"
+        )
+
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+tools/ingest_spool.py
+
+Worker de ingestão contínua: vigia um diretório "spool" e carrega os CSVs do
+Kiper que forem aparecendo, sem ninguém abrir a página Admin.
+
+- Arquivos que chegam próximos viram UM lote (espera `--quiet` segundos sem
+  novidade antes de processar; arquivo ainda sendo copiado é ignorado até o
+  tamanho parar de mudar)
+- Cada lote passa pelo pipeline do src/ingest.py (paralelo + COPY/merge + manifest)
+- Processados vão para <spool>/done, com erro no próprio arquivo para
+  <spool>/failed; se o banco cair no meio, o lote para e o arquivo da vez e
+  os que faltavam ficam no spool (próxima tentativa no próximo lote)
+- No máximo UM recálculo das passagens por lote (e só se entrou algo)
+
+Conexão: DATABASE_URL no ambiente (ou .env); sem isso, cai no st.secrets.
+
+Uso (na raiz do repo):
+    python -m tools.ingest_spool /dados/kiper/spool --quiet 15
+    python -m tools.ingest_spool /dados/kiper/spool --once   # processa o que houver e sai
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from datetime import datetime
+
+from src.ingest import ingest_kiper_files_parallel, default_ingest_workers
+from src.passages import refresh_passages
+
+
+def log(msg: str) -> None:
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {msg}", flush=True)
+
+
+def list_spool(spool: str) -> dict[str, tuple[int, float]]:
+    """CSVs no topo do spool -> (tamanho, mtime)."""
+    out = {}
+    for entry in os.scandir(spool):
+        if entry.is_file() and entry.name.lower().endswith(".csv") and not entry.name.startswith("."):
+            st = entry.stat()
+            out[entry.path] = (st.st_size, st.st_mtime)
+    return out
+
+
+def move_to(path: str, folder: str) -> str:
+    """Move o arquivo para `folder` sem sobrescrever (sufixo com horário se já existir)."""
+    os.makedirs(folder, exist_ok=True)
+    dest = os.path.join(folder, os.path.basename(path))
+    if os.path.exists(dest):
+        stem, ext = os.path.splitext(os.path.basename(path))
+        dest = os.path.join(folder, f"{stem}.{datetime.now():%Y%m%d%H%M%S}{ext}")
+    shutil.move(path, dest)
+    return dest
+
+
+class SpoolBatcher:
+    """
+    Decide quando um lote está pronto. Só entram arquivos "estáveis" (mesmo
+    tamanho/mtime da varredura anterior, ou seja, já terminaram de ser copiados)
+    e o lote fecha quando nada mudou no spool há `quiet` segundos — ou antes,
+    se já houver `max_batch` arquivos estáveis.
+    """
+
+    def __init__(self, quiet: float, max_batch: int):
+        self.quiet = quiet
+        self.max_batch = max_batch
+        self.seen: dict[str, tuple[int, float]] = {}
+        self.last_change = time.monotonic()
+
+    def observe(self, snapshot: dict[str, tuple[int, float]]) -> list[str] | None:
+        now = time.monotonic()
+        stable = sorted(p for p, sig in snapshot.items() if self.seen.get(p) == sig)
+        if snapshot != self.seen:
+            self.last_change = now
+        self.seen = snapshot
+
+        if not stable:
+            return None
+        if len(stable) < self.max_batch and now - self.last_change < self.quiet:
+            return None
+
+        batch = stable[: self.max_batch]
+        for p in batch:
+            self.seen.pop(p, None)
+        return batch
+
+
+def process_batch(paths: list[str], spool: str, workers: int, refresh: bool, skip_covered: bool = False) -> None:
+    by_name = {os.path.basename(p): p for p in paths}
+    done_dir = os.path.join(spool, "done")
+    failed_dir = os.path.join(spool, "failed")
+
+    log(f"[..] Lote com {len(paths)} arquivo(s)")
+    t0 = time.perf_counter()
+    events = 0
+
+    def on_file(info):
+        nonlocal events
+        path = by_name[info["file"]]
+        if info["error"]:
+            log(f"[ERRO] {info['file']}: {info['error']}")
+            move_to(path, failed_dir)
+            return
+        if info["skipped"]:
+            log(f"[PULA] {info['skipped']}")
+        else:
+            events += info["events"]
+            covered = f" ({info['covered']:,} já cobertos, não enviados)" if info["covered"] else ""
+            log(f"[OK] {info['file']}: {info['inserted']:,} novos • {info['duplicates']:,} duplicados{covered}")
+        move_to(path, done_dir)
+
+    try:
+        inserted, duplicates = ingest_kiper_files_parallel(
+            paths, max_workers=workers, on_file=on_file, skip_covered=skip_covered
+        )
+    except Exception as e:
+        # erro de infraestrutura (banco fora, conexão caiu): o ingest para no
+        # arquivo da vez sem chamar on_file, então ele e os que faltavam ficam
+        # no spool para o próximo lote
+        left = sum(os.path.exists(p) for p in paths)
+        log(f"[ERRO] Lote abortado, {left} arquivo(s) ficam no spool: {e}")
+        return
+
+    elapsed = time.perf_counter() - t0
+    log(
+        f"[OK] Lote: {inserted:,} novos • {duplicates:,} duplicados • {elapsed:.1f}s • "
+        f"{events / elapsed if elapsed else 0:,.0f} linhas/s"
+    )
+
+    if refresh and inserted:
+        t1 = time.perf_counter()
+        try:
+            stats = refresh_passages()
+            log(
+                f"[OK] {stats['passages']:,} passagens recalculadas ({stats['windows']:,} janela(s)) "
+                f"em {time.perf_counter() - t1:.1f}s"
+            )
+        except Exception as e:
+            # as janelas marcadas continuam na fila: o próximo lote recalcula
+            log(f"[ERRO] Falha ao recalcular as passagens: {e}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Vigia um diretório e ingere os CSVs do Kiper que chegarem.")
+    parser.add_argument("spool", help="diretório onde os CSVs são depositados")
+    parser.add_argument("--interval", type=float, default=2.0, help="segundos entre varreduras (padrão: %(default)s)")
+    parser.add_argument("--quiet", type=float, default=10.0,
+                        help="segundos sem arquivo novo antes de fechar o lote (padrão: %(default)s)")
+    parser.add_argument("--max-batch", type=int, default=50, help="máximo de arquivos por lote (padrão: %(default)s)")
+    parser.add_argument("--workers", type=int, default=default_ingest_workers(),
+                        help="processos lendo/normalizando em paralelo (padrão: %(default)s)")
+    parser.add_argument("--skip-covered", action="store_true",
+                        help="não envia linhas de portas/horários já cobertos por arquivos do manifest "
+                             "(só se os arquivos anteriores eram exports completos)")
+    parser.add_argument("--no-refresh", action="store_true", help="não recalcula as passagens")
+    parser.add_argument("--once", action="store_true", help="processa o que já está no spool e sai")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.spool):
+        print(f"[ERRO] Diretório não encontrado: {args.spool}", file=sys.stderr)
+        return 2
+
+    refresh = not args.no_refresh
+
+    if args.once:
+        paths = sorted(list_spool(args.spool))
+        for i in range(0, len(paths), args.max_batch):
+            process_batch(paths[i:i + args.max_batch], args.spool, args.workers, refresh, args.skip_covered)
+        return 0
+
+    log(f"[..] Vigiando {os.path.abspath(args.spool)} (lote fecha após {args.quiet:.0f}s sem novidades)")
+    batcher = SpoolBatcher(quiet=args.quiet, max_batch=args.max_batch)
+    try:
+        while True:
+            batch = batcher.observe(list_spool(args.spool))
+            if batch:
+                process_batch(batch, args.spool, args.workers, refresh, args.skip_covered)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        log("[OK] Encerrado.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())